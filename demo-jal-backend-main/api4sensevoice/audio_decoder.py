@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from loguru import logger
+
+# codec query parameter -> ffmpeg demuxer options for the incoming byte stream
+CODECS = {
+    "pcm": ["-f", "s16le", "-ac", "1"],  # raw little-endian int16, needs sample_rate
+    "opus": ["-f", "ogg"],  # Ogg Opus pages
+    "webm": ["-f", "matroska"],  # browser MediaRecorder (Opus in WebM)
+    "flac": ["-f", "flac"],
+    "mp3": ["-f", "mp3"],
+}
+# Only the end of ffmpeg's error output is kept for the log message.
+STDERR_TAIL_BYTES = 4096
+
+
+class StreamDecoder:
+    """Decodes and resamples an audio byte stream with an ffmpeg subprocess.
+
+    Bytes received from the client are written to ffmpeg's stdin as they
+    arrive; mono int16 PCM at `target_rate` is read back from its stdout. The
+    decoding and resampling work happens in the ffmpeg process, so it never
+    runs on the event loop, and only `feed` / `read` (non-blocking pipe I/O)
+    do. `sample_rate` is required for raw PCM input and ignored otherwise,
+    since containers carry their own rate.
+    """
+
+    def __init__(self, codec: str, sample_rate: int, target_rate: int = 16000):
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported codec: {codec}")
+        self.codec = codec
+        self.sample_rate = sample_rate
+        self.target_rate = target_rate
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._proc = None
+        self._stderr_task = None
+        self._stderr_tail = b""
+
+    def command(self) -> list:
+        input_args = list(CODECS[self.codec])
+        if self.codec == "pcm":
+            input_args += ["-ar", str(self.sample_rate)]
+        return [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            # Start decoding right away instead of buffering input to probe it.
+            "-probesize",
+            "32",
+            "-analyzeduration",
+            "0",
+            *input_args,
+            "-i",
+            "pipe:0",
+            "-f",
+            "s16le",
+            "-ac",
+            "1",
+            "-ar",
+            str(self.target_rate),
+            "-flush_packets",
+            "1",
+            "pipe:1",
+        ]
+
+    async def start(self):
+        self._proc = await asyncio.create_subprocess_exec(
+            *self.command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        # Drain stderr continuously: on a long corrupt stream ffmpeg keeps
+        # logging errors, and a full pipe would block it and hang `feed`.
+        self._stderr_task = asyncio.create_task(self._read_stderr())
+
+    async def _read_stderr(self):
+        while data := await self._proc.stderr.read(STDERR_TAIL_BYTES):
+            self._stderr_tail = (self._stderr_tail + data)[-STDERR_TAIL_BYTES:]
+
+    async def feed(self, data: bytes):
+        self.bytes_in += len(data)
+        self._proc.stdin.write(data)
+        await self._proc.stdin.drain()
+
+    async def read(self, size: int = 65536) -> bytes:
+        """Next decoded PCM bytes; b"" once ffmpeg has exited."""
+        data = await self._proc.stdout.read(size)
+        self.bytes_out += len(data)
+        return data
+
+    async def finish(self):
+        """Signal end of input; the remaining output can still be read."""
+        if self._proc is not None and not self._proc.stdin.is_closing():
+            self._proc.stdin.close()
+
+    async def close(self):
+        if self._proc is None:
+            return
+        await self.finish()
+        if self._proc.returncode is None:
+            try:
+                await asyncio.wait_for(self._proc.wait(), 1.0)
+            except asyncio.TimeoutError:
+                self._proc.kill()
+                await self._proc.wait()
+        await self._stderr_task
+        errors = self._stderr_tail.decode(errors="replace").strip()
+        if errors:
+            logger.warning(f"[decoder] {self.codec}: {errors}")
+        logger.info(
+            f"[decoder] codec: {self.codec}; bytes in: {self.bytes_in}; "
+            f"pcm bytes out: {self.bytes_out}"
+        )
+
+
+def decode_audio(data: bytes, target_rate: int = 16000) -> np.ndarray:
+    """Decode a whole file in any format ffmpeg reads to mono float32 at `target_rate`."""
+    proc = subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-i",
+            "pipe:0",
+            "-f",
+            "s16le",
+            "-ac",
+            "1",
+            "-ar",
+            str(target_rate),
+            "pipe:1",
+        ],
+        input=data,
+        capture_output=True,
+    )
+    if proc.returncode != 0:
+        raise ValueError(f"Cannot decode audio: {proc.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(proc.stdout, dtype=np.int16).astype(np.float32) / 32767.0
+
+
+async def _stream_file(path: str, codec: str, sample_rate: int, packet_bytes: int) -> float:
+    decoder = StreamDecoder(codec, sample_rate)
+    await decoder.start()
+
+    async def drain():
+        while await decoder.read():
+            pass
+
+    reader = asyncio.create_task(drain())
+    with open(path, "rb") as f:
+        while packet := f.read(packet_bytes):
+            await decoder.feed(packet)
+    await decoder.finish()
+    await reader
+    await decoder.close()
+    return decoder.bytes_out / 2 / decoder.target_rate
+
+
+if __name__ == "__main__":
+    # CPU cost of decode + resample per second of streamed audio, e.g.
+    #   python audio_decoder.py speaker/speaker1_a_cn_16k.wav
+    parser = argparse.ArgumentParser(description="Benchmark streaming decode + resample.")
+    parser.add_argument("wav")
+    parser.add_argument("--repeat", type=int, default=20, help="Concatenate the input N times")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="decoder_bench_")
+    source = os.path.join(workdir, "source.wav")
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-stream_loop", str(args.repeat - 1),
+         "-i", args.wav, source],
+        check=True,
+    )
+    # (codec, input sample rate, ffmpeg encoder options, ~bytes per 20 ms packet)
+    cases = [
+        ("pcm", 16000, ["-f", "s16le", "-ar", "16000", "-ac", "1"], 640),
+        ("pcm", 48000, ["-f", "s16le", "-ar", "48000", "-ac", "1"], 1920),
+        ("opus", 48000, ["-c:a", "libopus", "-b:a", "24k", "-ar", "48000", "-f", "ogg"], 60),
+        ("flac", 48000, ["-c:a", "flac", "-ar", "48000", "-f", "flac"], 1200),
+    ]
+    try:
+        for codec, rate, encode_args, packet_bytes in cases:
+            encoded = os.path.join(workdir, f"{codec}_{rate}")
+            subprocess.run(
+                ["ffmpeg", "-y", "-loglevel", "error", "-i", source, *encode_args, encoded],
+                check=True,
+            )
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            started = time.perf_counter()
+            seconds = asyncio.run(_stream_file(encoded, codec, rate, packet_bytes))
+            wall = time.perf_counter() - started
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+            kbps = os.path.getsize(encoded) * 8 / seconds / 1000
+            print(
+                f"{codec:>5} @ {rate:>5} Hz: {kbps:7.1f} kbit/s; {seconds:.1f}s of audio; "
+                f"ffmpeg CPU {cpu / seconds * 1000:.2f} ms per stream-second; wall {wall:.2f}s"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
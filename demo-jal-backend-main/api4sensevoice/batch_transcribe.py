@@ -0,0 +1,230 @@
+import argparse
+import itertools
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from loguru import logger
+
+from bucketing import LengthBucketer, PaddingStats
+from text_format import format_str_v4
+
+
+def vad_segments(model_vad, audio: np.ndarray, sample_rate: int = 16000, max_segment_ms: int = 30000):
+    """Speech segments [beg_ms, end_ms] of a whole recording, in one non-streaming VAD pass.
+
+    Segments longer than `max_segment_ms` are cut into equal parts, so no
+    single utterance dominates a padded batch.
+    """
+    res = model_vad.inference(
+        audio, kwargs=dict(model_vad.kwargs), cache={}, is_final=True, fs=sample_rate
+    )
+    segments = []
+    for beg, end in res[0]["value"] if res else []:
+        parts = max(1, -(-(end - beg) // max_segment_ms))
+        step = (end - beg) / parts
+        segments.extend(
+            [int(beg + i * step), int(beg + (i + 1) * step) if i < parts - 1 else end]
+            for i in range(parts)
+        )
+    return segments
+
+
+def transcribe_audio(
+    model_asr,
+    model_vad,
+    audio: np.ndarray,
+    sample_rate: int = 16000,
+    language: str = "auto",
+    use_itn: bool = True,
+    batch_size_s: float = 300,
+    max_batch_size: int = 64,
+    max_segment_ms: int = 30000,
+    bucketer: LengthBucketer = None,
+    padding_stats: PaddingStats = None,
+    progress=None,
+    **kwargs,
+) -> dict:
+    """Timestamped transcript of a whole recording.
+
+    VAD runs once over the file, segments are transcribed in length-bucketed
+    padded batches (`transcribe_pcm`) and the result is put back in time order.
+    `progress(done_s, total_s)` is called after each batch with seconds of
+    speech transcribed so far; batch shapes are also added to `padding_stats`.
+    Extra kwargs (e.g. `device`, `logits_fn`) go to `transcribe_pcm`.
+    """
+    started = time.perf_counter()
+    duration = len(audio) / sample_rate
+    segments = vad_segments(model_vad, audio, sample_rate, max_segment_ms)
+    vad_time = time.perf_counter() - started
+    samples = [
+        audio[int(beg * sample_rate / 1000) : int(end * sample_rate / 1000)]
+        for beg, end in segments
+    ]
+    lengths = [len(s) for s in samples]
+    total_s = sum(lengths) / sample_rate
+    done_s = 0.0
+    if progress is not None:
+        progress(done_s, total_s)
+
+    texts = [None] * len(segments)
+    bucketer = bucketer or LengthBucketer(sample_rate=sample_rate)
+    batches = bucketer.batches(lengths, batch_size_s, max_batch_size)
+    padding = PaddingStats()
+    for batch in batches:
+        padding.record([lengths[i] for i in batch])
+        if padding_stats is not None:
+            padding_stats.record([lengths[i] for i in batch])
+        with torch.inference_mode():
+            results, meta_data = model_asr.model.transcribe_pcm(
+                [samples[i] for i in batch],
+                key=[f"seg_{i}" for i in batch],
+                tokenizer=model_asr.kwargs["tokenizer"],
+                frontend=model_asr.kwargs["frontend"],
+                language=language,
+                use_itn=use_itn,
+                **kwargs,
+            )
+        for i, result in zip(batch, results):
+            texts[i] = result["text"]
+        done_s += sum(lengths[i] for i in batch) / sample_rate
+        if progress is not None:
+            progress(done_s, total_s)
+
+    elapsed = time.perf_counter() - started
+    transcript = [
+        {"start": beg, "end": end, "text": format_str_v4(raw), "raw": raw}
+        for (beg, end), raw in zip(segments, texts)
+    ]
+    padding = padding.snapshot()
+    logger.info(
+        f"[batch] duration: {duration:.1f}s; segments: {len(segments)}; batches: {len(batches)}; "
+        f"padding efficiency: {padding['sample_efficiency']:.2f}; "
+        f"vad: {vad_time:.2f}s; total: {elapsed:.2f}s; speed: {duration / max(elapsed, 1e-9):.1f}x"
+    )
+    return {
+        "duration": duration,
+        "elapsed": round(elapsed, 3),
+        "padding": padding,
+        "segments": transcript,
+        "text": " ".join(s["text"] for s in transcript if s["text"]),
+    }
+
+
+class BatchJobs:
+    """Background batch transcriptions with progress, keyed by job id.
+
+    Finished jobs are kept until `max_finished` newer ones have completed.
+    """
+
+    def __init__(self, max_finished: int = 100):
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, filename: str = "") -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id,
+                "filename": filename,
+                "state": "queued",
+                "progress": 0.0,
+                "created": time.time(),
+                "result": None,
+                "error": None,
+            }
+        return job_id
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id: str, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            if fields.get("state") in ("done", "failed"):
+                finished = [k for k, j in self._jobs.items() if j["state"] in ("done", "failed")]
+                for k in finished[: max(0, len(finished) - self.max_finished)]:
+                    del self._jobs[k]
+
+    def run(self, job_id: str, fn, *args, **kwargs):
+        """Run `fn(*args, progress=..., **kwargs)` as the job (blocking).
+
+        Errors are recorded on the job (state "failed") rather than raised.
+        """
+
+        def progress(done_s, total_s):
+            self.update(job_id, progress=round(done_s / total_s, 4) if total_s else 1.0)
+
+        self.update(job_id, state="running")
+        try:
+            result = fn(*args, progress=progress, **kwargs)
+        except Exception as e:
+            logger.error(f"[batch] job {job_id} failed: {e}")
+            self.update(job_id, state="failed", error=str(e))
+            return
+        self.update(job_id, state="done", progress=1.0, result=result)
+
+
+if __name__ == "__main__":
+    from funasr import AutoModel
+
+    from audio_decoder import decode_audio
+
+    parser = argparse.ArgumentParser(description="Transcribe recordings offline.")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--lang", default="auto")
+    parser.add_argument("--no-itn", action="store_true")
+    parser.add_argument("--device", default="cuda:0" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--batch-size-s", type=float, default=300)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--no-sdpa", action="store_true", help="Use the matmul attention path")
+    parser.add_argument("--output", default=None, help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    model_asr = AutoModel(
+        model="iic/SenseVoiceSmall",
+        trust_remote_code=True,
+        remote_code="./model.py",
+        device=args.device,
+        disable_update=True,
+    )
+    model_asr.model.set_sdpa(not args.no_sdpa)
+    model_vad = AutoModel(model="fsmn-vad", model_revision="v2.0.4", disable_pbar=True, disable_update=True)
+
+    outputs = {}
+    for path in args.files:
+        with open(path, "rb") as f:
+            audio = decode_audio(f.read())
+        spinner = itertools.cycle("|/-\\")
+
+        def progress(done_s, total_s):
+            sys.stderr.write(f"\r{next(spinner)} {path}: {done_s:.0f}/{total_s:.0f}s of speech")
+            sys.stderr.flush()
+
+        outputs[path] = transcribe_audio(
+            model_asr,
+            model_vad,
+            audio,
+            language=args.lang,
+            use_itn=not args.no_itn,
+            batch_size_s=args.batch_size_s,
+            max_batch_size=args.max_batch_size,
+            progress=progress,
+            device=args.device,
+        )
+        sys.stderr.write("\n")
+
+    text = json.dumps(outputs, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
@@ -0,0 +1,181 @@
+import argparse
+import bisect
+import threading
+import time
+from typing import List, Sequence
+
+import numpy as np
+
+# Upper edges, in seconds, of the length buckets. Inside one bucket the
+# longest segment is at most twice the shortest, so a batch is at least
+# half real audio (and a quarter real attention work) whatever the mix.
+DEFAULT_BUCKETS_S = (1, 2, 4, 8, 16, 32)
+
+
+class LengthBucketer:
+    """Groups segments of similar length so batches carry little padding.
+
+    A batched encoder pass pads every segment to the longest one in the batch
+    and the SANM self-attention then costs T x T for every padded row, so one
+    long segment in a batch of short ones multiplies the work. `bucket`
+    maps a length to its bucket; `batches` sorts segments by length and never
+    lets a batch span two buckets.
+    """
+
+    def __init__(self, bounds_s: Sequence[float] = DEFAULT_BUCKETS_S, sample_rate: int = 16000):
+        self.bounds = [int(b * sample_rate) for b in bounds_s]
+        self.sample_rate = sample_rate
+
+    def bucket(self, length: int) -> int:
+        return bisect.bisect_left(self.bounds, length)
+
+    def batches(self, lengths: Sequence[int], batch_size_s: float, max_batch_size: int) -> List[list]:
+        """Indices of `lengths`, longest first, in batches of one bucket each.
+
+        A batch is also closed once it holds `max_batch_size` segments or its
+        padded size (count * longest) would exceed `batch_size_s` seconds.
+        """
+        budget = batch_size_s * self.sample_rate
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+        batches, batch = [], []
+        for i in order:
+            if batch and (
+                len(batch) >= max_batch_size
+                or self.bucket(lengths[i]) != self.bucket(lengths[batch[0]])
+                or (len(batch) + 1) * lengths[batch[0]] > budget
+            ):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+
+def padding_cost(lengths: Sequence[int]) -> dict:
+    """Real vs padded work of one batch of segment lengths.
+
+    `samples` is linear in length (feed-forward, FSMN, projections);
+    `attention` is quadratic (the T x T score and context products).
+    """
+    longest = max(lengths)
+    return {
+        "samples": sum(lengths),
+        "padded_samples": longest * len(lengths),
+        "attention": sum(n * n for n in lengths),
+        "padded_attention": longest * longest * len(lengths),
+    }
+
+
+class PaddingStats:
+    """Running padding efficiency (real / padded work) of batched passes."""
+
+    def __init__(self):
+        self.batches = 0
+        self.totals = dict.fromkeys(("samples", "padded_samples", "attention", "padded_attention"), 0)
+        self._lock = threading.Lock()
+
+    def record(self, lengths: Sequence[int]):
+        if not lengths:
+            return
+        cost = padding_cost(lengths)
+        with self._lock:
+            self.batches += 1
+            for k, v in cost.items():
+                self.totals[k] += v
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            t = dict(self.totals)
+            batches = self.batches
+        return {
+            "batches": batches,
+            "sample_efficiency": t["samples"] / t["padded_samples"] if t["padded_samples"] else 1.0,
+            "attention_efficiency": (
+                t["attention"] / t["padded_attention"] if t["padded_attention"] else 1.0
+            ),
+        }
+
+
+def _arrival_batches(lengths, batch_size_s, max_batch_size, sample_rate=16000):
+    """Batches in arrival order, as `inference` forms them from a list of inputs."""
+    return [list(range(i, min(i + max_batch_size, len(lengths)))) for i in range(0, len(lengths), max_batch_size)]
+
+
+def _sorted_batches(lengths, batch_size_s, max_batch_size, sample_rate=16000):
+    """Length-sorted batches without bucket boundaries."""
+    return LengthBucketer((), sample_rate).batches(lengths, batch_size_s, max_batch_size)
+
+
+if __name__ == "__main__":
+    # Padding efficiency, estimated encoder FLOPs and measured encoder latency
+    # of arrival-order, length-sorted and bucketed batches over VAD-like
+    # segment lengths (log-normal, median ~3 s, clipped to 0.3-30 s). The
+    # encoder is SenseVoiceSmall-sized with random weights, which does not
+    # change its cost.
+    import torch
+
+    from model import SenseVoiceEncoderSmall
+
+    parser = argparse.ArgumentParser(description="Benchmark length-bucketed batching.")
+    parser.add_argument("--segments", type=int, default=96)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--batch-size-s", type=float, default=300)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--no-time", action="store_true", help="Only report padding and FLOPs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sample_rate, frame_s = 16000, 0.06  # fbank frames after LFR (6 x 10 ms)
+    rng = np.random.RandomState(args.seed)
+    seconds = np.clip(rng.lognormal(np.log(3.0), 0.9, args.segments), 0.3, 30.0)
+    lengths = [int(s * sample_rate) for s in seconds]
+
+    d_model, ffn, blocks = 512, 2048, 50 + 20  # encoder + tp blocks
+    def encoder_flops(frames, batch):
+        # Per block: q/k/v/out projections and FFN (linear), scores and context (quadratic).
+        linear = 2 * frames * (4 * d_model * d_model + 2 * d_model * ffn)
+        return batch * blocks * (linear + 4 * frames * frames * d_model)
+
+    strategies = {
+        "arrival": _arrival_batches,
+        "sorted": _sorted_batches,
+        "bucketed": lambda *a: LengthBucketer().batches(*a),
+    }
+    encoder = None
+    if not args.no_time:
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        torch.manual_seed(0)
+        encoder = SenseVoiceEncoderSmall(
+            input_size=560, output_size=d_model, attention_heads=4, linear_units=ffn,
+            num_blocks=50, tp_blocks=20, kernel_size=11,
+        ).eval()
+
+    print(
+        f"{args.segments} segments, {seconds.sum():.0f}s of speech; "
+        f"median {np.median(seconds):.1f}s, max {seconds.max():.1f}s"
+    )
+    for name, make in strategies.items():
+        batches = make(lengths, args.batch_size_s, args.batch_size)
+        stats = PaddingStats()
+        flops = 0
+        for batch in batches:
+            stats.record([lengths[i] for i in batch])
+            flops += encoder_flops(int(max(lengths[i] for i in batch) / sample_rate / frame_s), len(batch))
+        line = (
+            f"{name:>8}: {len(batches):3d} batches; "
+            f"sample eff {stats.snapshot()['sample_efficiency']:.2f}; "
+            f"attention eff {stats.snapshot()['attention_efficiency']:.2f}; "
+            f"{flops / 1e12:.2f} TFLOP"
+        )
+        if encoder is not None:
+            started = time.perf_counter()
+            with torch.inference_mode():
+                for batch in batches:
+                    frames = [int(lengths[i] / sample_rate / frame_s) for i in batch]
+                    xs = torch.randn(len(batch), max(frames), 560)
+                    encoder(xs, torch.tensor(frames))
+            elapsed = time.perf_counter() - started
+            line += f"; encoder {elapsed:.2f}s (RTF {elapsed / seconds.sum():.4f})"
+        print(line)
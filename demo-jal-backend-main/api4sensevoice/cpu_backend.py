@@ -0,0 +1,423 @@
+import argparse
+import bisect
+import copy
+import glob
+import os
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from loguru import logger
+
+BACKENDS = ("torch", "torch_int8", "torch_bf16", "torch_compile", "onnx", "onnx_int8")
+
+# Padded lengths, in seconds of audio, the torch_compile backend builds graphs for.
+COMPILE_BUCKETS_S = (2, 5, 10, 20, 30)
+FRAME_S = 0.06  # one fbank frame after LFR (6 x 10 ms)
+
+
+def set_cpu_threads(intra_op_threads: int = 0, inter_op_threads: int = 0):
+    """Set torch's CPU thread pools; 0 keeps the default."""
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads > 0:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # Only allowed before the first inter-op parallel work has started.
+            logger.warning(f"[cpu_backend] inter-op threads left unchanged: {e}")
+
+
+def export_onnx(model, model_dir: str, quantize: bool = False, opset_version: int = 14) -> str:
+    """Export `model.export()` to `model_dir`/model.onnx and return its path.
+
+    With `quantize` the MatMul weights are additionally quantized to int8
+    (dynamic quantization, activations stay float) into model_quant.onnx.
+    Existing files are reused; delete them to re-export.
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    model_path = os.path.join(model_dir, "model.onnx")
+    if not os.path.exists(model_path):
+        module = model.export().eval()
+        device = next(model.parameters()).device
+        dummy_inputs = tuple(x.to(device) for x in module.export_dummy_inputs())
+        started = time.perf_counter()
+        # The fused attention does not export with dynamic lengths; trace the
+        # matmul path, which computes the same thing with plain ONNX ops.
+        sdpa_layers = [m for m in model.modules() if getattr(m, "use_sdpa", False)]
+        model.set_sdpa(False)
+        try:
+            with torch.no_grad():
+                torch.onnx.export(
+                    module,
+                    dummy_inputs,
+                    model_path,
+                    input_names=module.export_input_names(),
+                    output_names=module.export_output_names(),
+                    dynamic_axes=module.export_dynamic_axes(),
+                    opset_version=opset_version,
+                )
+        finally:
+            for m in sdpa_layers:
+                m.use_sdpa = True
+        logger.info(
+            f"[cpu_backend] exported {model_path} in {time.perf_counter() - started:.1f}s"
+        )
+    if not quantize:
+        return model_path
+
+    quant_path = os.path.join(model_dir, "model_quant.onnx")
+    if not os.path.exists(quant_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(
+            model_input=model_path,
+            model_output=quant_path,
+            op_types_to_quantize=["MatMul"],
+            per_channel=True,
+            reduce_range=False,
+            weight_type=QuantType.QUInt8,
+        )
+        logger.info(f"[cpu_backend] quantized {quant_path}")
+    return quant_path
+
+
+class ExportedLogits(ABC):
+    """Drop-in replacement for `SenseVoiceSmall.ctc_logits` backed by an exported model.
+
+    Pass an instance as `logits_fn` to `transcribe_pcm` / `inference`. The
+    decoding options (language, use_itn, text_norm, ban_emo_unk) are mapped to
+    the prompt ids the exported graph takes as inputs. Runs on the CPU.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, speech: torch.Tensor, speech_lengths: torch.Tensor, **kwargs):
+        language_id, textnorm_id = self.model.prompt_ids(
+            kwargs.get("language", "auto"),
+            kwargs.get("use_itn", False),
+            kwargs.get("text_norm", None),
+        )
+        batch_size = speech.size(0)
+        ctc_logits, encoder_out_lens = self._run(
+            speech.detach().cpu().float().contiguous(),
+            speech_lengths.cpu().to(torch.int32),
+            torch.full((batch_size,), language_id, dtype=torch.long),
+            torch.full((batch_size,), textnorm_id, dtype=torch.long),
+        )
+        if kwargs.get("ban_emo_unk", False):
+            ctc_logits[:, :, self.model.emo_dict["unk"]] = -float("inf")
+        return ctc_logits, encoder_out_lens
+
+    @abstractmethod
+    def _run(self, speech, speech_lengths, language, textnorm):
+        """(ctc_logits, encoder_out_lens) for one padded batch."""
+
+
+class TorchInt8Logits(ExportedLogits):
+    """PyTorch eager with int8 dynamically quantized Linear layers.
+
+    The quantized module is a copy; the float model is left untouched for the
+    streaming partial path.
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        module = copy.deepcopy(model.export()).cpu().eval()
+        self.module = torch.ao.quantization.quantize_dynamic(
+            module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+
+    def _run(self, speech, speech_lengths, language, textnorm):
+        with torch.inference_mode():
+            return self.module(speech, speech_lengths, language, textnorm)
+
+
+class TorchBf16Logits(ExportedLogits):
+    """PyTorch eager with a bfloat16 copy of the encoder.
+
+    Weights are converted once, so no layer copies them per call; LayerNorm
+    and the position encodings still compute their statistics in float32.
+    The CTC projection stays float32, so log-probabilities (and the
+    avg_logprob filter) keep full precision. Only faster than float32 on CPUs
+    with native bfloat16 matrix instructions (AVX512-BF16 / AMX).
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.module = copy.deepcopy(model.export()).cpu().eval().to(torch.bfloat16)
+        ctc_lo = self.module.model.ctc.ctc_lo.float()
+        ctc_lo.register_forward_pre_hook(lambda module, args: (args[0].float(),))
+
+    def _run(self, speech, speech_lengths, language, textnorm):
+        with torch.inference_mode():
+            return self.module(speech.to(torch.bfloat16), speech_lengths, language, textnorm)
+
+
+class CompiledLogits(ExportedLogits):
+    """`torch.compile`d encoder, one static-length graph per padded length bucket.
+
+    Features are zero-padded up to the next bucket (the padding is masked, so
+    results do not change) and run through the graph compiled for that
+    length; inputs longer than the largest bucket run eagerly. Graphs are
+    specialized on length only: batch 1 and larger batches get one graph
+    each, the latter with a dynamic batch dimension. `warmup` compiles every
+    bucket so no request waits for the compiler. Shares the weights of `model`.
+    """
+
+    def __init__(self, model, buckets_s=COMPILE_BUCKETS_S):
+        super().__init__(model)
+        self.module = model.export().eval()
+        self.compiled = torch.compile(self.module)
+        self.buckets = sorted(int(b / FRAME_S) for b in buckets_s)
+        # Two graphs per bucket (batch 1 / dynamic batch) must fit in dynamo's cache.
+        limit = 2 * len(self.buckets) + 2
+        for name in ("recompile_limit", "cache_size_limit"):
+            if getattr(torch._dynamo.config, name, limit) < limit:
+                setattr(torch._dynamo.config, name, limit)
+
+    def warmup(self, max_batch_size: int = 2):
+        """Compile every bucket for batch 1 and for a dynamic batch size."""
+        for frames in self.buckets:
+            for batch_size in sorted({1, max(2, max_batch_size)}):
+                started = time.perf_counter()
+                self._run(
+                    torch.zeros(batch_size, frames, self.module.input_size),
+                    torch.full((batch_size,), frames, dtype=torch.int32),
+                    torch.zeros(batch_size, dtype=torch.long),
+                    torch.full((batch_size,), 15, dtype=torch.long),
+                )
+                logger.info(
+                    f"[cpu_backend] compiled {frames * FRAME_S:g}s bucket, batch {batch_size}, "
+                    f"in {time.perf_counter() - started:.1f}s"
+                )
+
+    def latency_report(self, batch_size: int = 4, repeat: int = 3) -> list:
+        """Median latency of eager vs compiled per bucket, on full-length inputs."""
+        rows = []
+        for frames in self.buckets:
+            inputs = (
+                torch.randn(batch_size, frames, self.module.input_size),
+                torch.full((batch_size,), frames, dtype=torch.int32),
+                torch.zeros(batch_size, dtype=torch.long),
+                torch.full((batch_size,), 15, dtype=torch.long),
+            )
+            timings = {}
+            for name, fn in (("eager", self.module), ("compiled", self._run)):
+                elapsed = []
+                for _ in range(repeat + 1):  # the first run is not timed
+                    started = time.perf_counter()
+                    with torch.inference_mode():
+                        fn(*inputs)
+                    elapsed.append(time.perf_counter() - started)
+                timings[name] = np.median(elapsed[1:]) * 1000
+            rows.append(
+                {
+                    "seconds": round(frames * FRAME_S, 2),
+                    "batch_size": batch_size,
+                    "eager_ms": timings["eager"],
+                    "compiled_ms": timings["compiled"],
+                }
+            )
+        return rows
+
+    def _run(self, speech, speech_lengths, language, textnorm):
+        frames = speech.size(1)
+        index = bisect.bisect_left(self.buckets, frames)
+        with torch.inference_mode():
+            if index == len(self.buckets):
+                return self.module(speech, speech_lengths, language, textnorm)
+            speech = F.pad(speech, (0, 0, 0, self.buckets[index] - frames))
+            inputs = (speech, speech_lengths, language, textnorm)
+            torch._dynamo.mark_static(speech, 1)
+            if speech.size(0) > 1:
+                for x in inputs:
+                    torch._dynamo.mark_dynamic(x, 0)
+            ctc_logits, encoder_out_lens = self.compiled(*inputs)
+        # 4 prompt frames precede the features.
+        return ctc_logits[:, : frames + 4], encoder_out_lens
+
+
+class OnnxLogits(ExportedLogits):
+    """ONNX Runtime CPU session over the exported (optionally int8) graph."""
+
+    def __init__(
+        self,
+        model,
+        model_dir: str,
+        quantize: bool = False,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+    ):
+        import onnxruntime as ort
+
+        super().__init__(model)
+        self.model_path = export_onnx(model, model_dir, quantize=quantize)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads > 1:
+            # Inter-op threads are only used by the parallel executor.
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+            options.inter_op_num_threads = inter_op_threads
+        self.session = ort.InferenceSession(
+            self.model_path, options, providers=["CPUExecutionProvider"]
+        )
+
+    def _run(self, speech, speech_lengths, language, textnorm):
+        ctc_logits, encoder_out_lens = self.session.run(
+            None,
+            {
+                "speech": speech.numpy(),
+                "speech_lengths": speech_lengths.numpy(),
+                "language": language.numpy(),
+                "textnorm": textnorm.numpy(),
+            },
+        )
+        return torch.from_numpy(ctc_logits), torch.from_numpy(encoder_out_lens)
+
+
+def build_logits_fn(
+    model,
+    backend: str = "torch",
+    model_dir: str = None,
+    intra_op_threads: int = 0,
+    inter_op_threads: int = 0,
+    compile_buckets_s=COMPILE_BUCKETS_S,
+):
+    """Return the `logits_fn` for `backend`, or None for the plain PyTorch model."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown ASR backend: {backend}")
+    started = time.perf_counter()
+    if backend == "torch":
+        logits_fn = None
+    elif backend == "torch_int8":
+        logits_fn = TorchInt8Logits(model)
+    elif backend == "torch_bf16":
+        logits_fn = TorchBf16Logits(model)
+    elif backend == "torch_compile":
+        logits_fn = CompiledLogits(model, compile_buckets_s)
+    else:
+        logits_fn = OnnxLogits(
+            model,
+            model_dir,
+            quantize=backend == "onnx_int8",
+            intra_op_threads=intra_op_threads,
+            inter_op_threads=inter_op_threads,
+        )
+    logger.info(
+        f"[cpu_backend] backend: {backend}; ready in {time.perf_counter() - started:.1f}s"
+    )
+    return logits_fn
+
+
+def _edit_distance(a, b) -> int:
+    row = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        prev, row[0] = row[0], i
+        for j, y in enumerate(b, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (x != y))
+    return row[-1]
+
+
+if __name__ == "__main__":
+    # Parity and real-time factor of every backend against the PyTorch model, e.g.
+    #   python cpu_backend.py --wavs speaker/*.wav --intra-op-threads 8
+    import soundfile as sf
+    from funasr import AutoModel
+
+    parser = argparse.ArgumentParser(description="Compare SenseVoiceSmall CPU backends.")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--wavs", nargs="+", default=sorted(glob.glob("speaker/*.wav")))
+    parser.add_argument("--model-dir", default=None, help="Where exported models are kept")
+    parser.add_argument("--intra-op-threads", type=int, default=0)
+    parser.add_argument("--inter-op-threads", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--compile-batch-size", type=int, default=4)
+    args = parser.parse_args()
+
+    set_cpu_threads(args.intra_op_threads, args.inter_op_threads)
+    model_asr = AutoModel(
+        model="iic/SenseVoiceSmall",
+        trust_remote_code=True,
+        remote_code="./model.py",
+        device="cpu",
+        disable_update=True,
+    )
+    model = model_asr.model.eval()
+    tokenizer = model_asr.kwargs["tokenizer"]
+    frontend = model_asr.kwargs["frontend"]
+    model_dir = args.model_dir or os.path.join(model_asr.kwargs.get("model_path", "."), "onnx")
+
+    audios = [sf.read(f, dtype="float32")[0] for f in args.wavs]
+    duration = sum(len(a) for a in audios) / frontend.fs
+    speech, speech_lengths = model.extract_fbank_batch(
+        [torch.from_numpy(a) for a in audios], frontend
+    )
+    decode_options = dict(language="auto", use_itn=True)
+    with torch.no_grad():
+        ref_logits, ref_lens = model.ctc_logits(speech, speech_lengths, **decode_options)
+        ref_results, _ = model.transcribe_pcm(
+            audios, tokenizer=tokenizer, frontend=frontend, device="cpu", **decode_options
+        )
+    valid = (torch.arange(ref_logits.size(1))[None, :] < ref_lens[:, None])[..., None]
+    # Float32 backends must reproduce the reference log-probs; quantized and
+    # bfloat16 ones are held to frame-level argmax agreement instead.
+    max_logit_diff = {"torch": 1e-4, "torch_compile": 1e-3, "onnx": 1e-3}
+    min_argmax_agree = {"torch_int8": 0.95, "torch_bf16": 0.95, "onnx_int8": 0.95}
+    failures = []
+
+    print(f"{len(audios)} files, {duration:.1f}s of audio, torch threads: {torch.get_num_threads()}")
+    print(
+        f"{'backend':>12} {'max|dlogp|':>11} {'argmax agree':>13} {'same text':>10} "
+        f"{'CER vs fp32':>12} {'RTF':>8}"
+    )
+    for backend in args.backends:
+        logits_fn = build_logits_fn(
+            model, backend, model_dir, args.intra_op_threads, args.inter_op_threads
+        )
+        if isinstance(logits_fn, CompiledLogits):
+            logits_fn.warmup(max(args.compile_batch_size, len(audios)))
+        with torch.no_grad():
+            logits, _ = (logits_fn or model.ctc_logits)(speech, speech_lengths, **decode_options)
+            max_diff = ((logits - ref_logits).abs() * valid).max().item()
+            agree = (
+                (logits.argmax(-1) == ref_logits.argmax(-1)) & valid[..., 0]
+            ).sum().item() / valid.sum().item()
+            elapsed = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                results, _ = model.transcribe_pcm(
+                    audios,
+                    tokenizer=tokenizer,
+                    frontend=frontend,
+                    device="cpu",
+                    logits_fn=logits_fn,
+                    **decode_options,
+                )
+                elapsed.append(time.perf_counter() - started)
+        same = sum(r["text"] == ref["text"] for r, ref in zip(results, ref_results))
+        # Character error rate against the float32 transcripts (the samples
+        # have no reference text; for CJK this is the usual WER stand-in).
+        cer = sum(
+            _edit_distance(r["text"], ref["text"]) for r, ref in zip(results, ref_results)
+        ) / max(1, sum(len(ref["text"]) for ref in ref_results))
+        print(
+            f"{backend:>12} {max_diff:11.4f} {agree:13.4f} {same:>4}/{len(audios):<5} "
+            f"{cer:12.4f} {np.median(elapsed) / duration:8.4f}"
+        )
+        if max_diff > max_logit_diff.get(backend, float("inf")):
+            failures.append(f"{backend}: max|dlogp| {max_diff:.2e} > {max_logit_diff[backend]:g}")
+        if agree < min_argmax_agree.get(backend, 0.0):
+            failures.append(f"{backend}: argmax agreement {agree:.4f} < {min_argmax_agree[backend]:g}")
+        if isinstance(logits_fn, CompiledLogits):
+            for row in logits_fn.latency_report(args.compile_batch_size, args.repeat):
+                print(
+                    f"{'':>12} {row['seconds']:g}s x {row['batch_size']}: "
+                    f"eager {row['eager_ms']:.1f} ms; compiled {row['compiled_ms']:.1f} ms"
+                )
+    assert not failures, "parity regression: " + "; ".join(failures)
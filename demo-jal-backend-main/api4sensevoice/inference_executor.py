@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import functools
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from loguru import logger
+
+
+class InferenceExecutor:
+    """Runs blocking model calls outside the asyncio event loop.
+
+    Calls that mutate per-connection state (streaming VAD keeps its state in a
+    `cache` dict owned by the connection) always go to a thread pool. Stateless
+    calls (ASR batches, speaker verification) go to `kind`, either a thread pool
+    or a process pool. The process pool uses the `fork` start method so workers
+    inherit the models already loaded in the parent; it therefore only works
+    with CPU models.
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: int = 4, stream_workers: int = 4):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.stream_pool = ThreadPoolExecutor(
+            max_workers=stream_workers, thread_name_prefix="stream"
+        )
+        if kind == "process":
+            self.model_pool = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("fork")
+            )
+        else:
+            self.model_pool = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="model"
+            )
+        logger.info(
+            f"[executor] kind: {kind}; model workers: {max_workers}; stream workers: {stream_workers}"
+        )
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a stateless call on the model pool."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.model_pool, functools.partial(fn, *args, **kwargs)
+        )
+
+    async def run_stateful(self, fn, *args, **kwargs):
+        """Run a call whose arguments are mutated in place (e.g. a VAD cache).
+
+        If the caller is cancelled the call is still awaited before the
+        cancellation propagates, so the state is never touched after the caller
+        has given it up.
+        """
+        future = asyncio.get_running_loop().run_in_executor(
+            self.stream_pool, functools.partial(fn, *args, **kwargs)
+        )
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait({future})
+            raise
+
+    def shutdown(self):
+        self.stream_pool.shutdown(wait=False)
+        self.model_pool.shutdown(wait=False)
+
+
+class BacklogFullError(RuntimeError):
+    pass
+
+
+class ChunkQueue:
+    """Bounded queue of received audio packets waiting to be processed.
+
+    Decouples a connection's receive loop from its VAD/ASR processing. When more
+    than `maxsize` packets are pending the `policy` decides what happens:
+    ``"merge"`` appends the new packet to the newest pending one so no audio is
+    lost (latency grows, the number of pending items does not), ``"drop"``
+    discards the oldest pending packet so latency stays bounded.
+
+    `max_bytes` bounds the pending audio itself: past it ``"drop"`` discards
+    the oldest packets and ``"merge"`` raises `BacklogFullError`, since it
+    cannot keep every byte anymore; the caller should close the connection.
+    """
+
+    def __init__(self, maxsize: int = 32, policy: str = "merge", max_bytes: int = None):
+        if policy not in ("merge", "drop"):
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self.merged = 0
+        self.pending_bytes = 0
+        self._items = deque()
+        self._ready = asyncio.Event()
+        self._carry = b""
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, data):
+        if self.max_bytes is not None and self.pending_bytes + len(data) > self.max_bytes:
+            if self.policy == "merge":
+                raise BacklogFullError(
+                    f"{self.pending_bytes + len(data)} bytes pending, limit {self.max_bytes}"
+                )
+            while self._items and self.pending_bytes + len(data) > self.max_bytes:
+                self.pending_bytes -= len(self._items.popleft())
+                self.dropped += 1
+        if self._items and len(self._items) >= self.maxsize:
+            if self.policy == "merge":
+                # Grow the newest item in place: concatenating bytes would copy
+                # the whole backlog on every merged packet.
+                tail = self._items[-1]
+                if not isinstance(tail, bytearray):
+                    tail = self._items[-1] = bytearray(tail)
+                tail += data
+                self.pending_bytes += len(data)
+                self.merged += 1
+                return
+            self.pending_bytes -= len(self._items.popleft())
+            self.dropped += 1
+        self._items.append(data)
+        self.pending_bytes += len(data)
+        self._ready.set()
+
+    def put_pcm16(self, data: bytes):
+        """Queue int16 PCM, holding back a trailing odd byte until the next call.
+
+        Only whole samples are queued, so dropping a packet under backpressure
+        can never misalign the sample stream.
+        """
+        data = self._carry + data
+        usable = len(data) - (len(data) % 2)
+        self._carry = data[usable:]
+        if usable:
+            self.put(data[:usable])
+
+    async def get(self):
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        data = self._items.popleft()
+        self.pending_bytes -= len(data)
+        return data
+
+
+def _busy(ms: float, work, per_matmul_ms: float):
+    """Stand-in for a model call: `ms` of Torch compute, which releases the GIL."""
+    for _ in range(max(1, round(ms / per_matmul_ms))):
+        work @ work
+
+
+async def _client(executor, inline, args, lateness, work, per_matmul_ms):
+    """One simulated /ws/transcribe connection.
+
+    The receive loop queues a 20 ms packet on schedule; lateness of each
+    packet is how long the event loop kept the socket from being read. The
+    processing task mirrors `transcribe_stream`: VAD once per chunk, ASR once
+    per segment.
+    """
+    pending = ChunkQueue(args.max_pending_chunks, args.policy)
+    packet = b"\0" * int(args.sample_rate * 0.02) * 2
+    chunk_bytes = int(args.sample_rate * args.chunk_ms / 1000) * 2
+    chunks_per_segment = max(1, round(args.segment_s * 1000 / args.chunk_ms))
+
+    async def call(fn, *fn_args):
+        if inline:
+            return fn(*fn_args)
+        return await executor.run(fn, *fn_args)
+
+    async def process():
+        buffered = 0
+        chunks = 0
+        while True:
+            buffered += len(await pending.get())
+            while buffered >= chunk_bytes:
+                buffered -= chunk_bytes
+                chunks += 1
+                if inline:
+                    _busy(args.vad_ms, work, per_matmul_ms)
+                else:
+                    await executor.run_stateful(_busy, args.vad_ms, work, per_matmul_ms)
+                if chunks % chunks_per_segment == 0:
+                    await call(_busy, args.asr_ms, work, per_matmul_ms)
+
+    processor = asyncio.create_task(process())
+    loop = asyncio.get_running_loop()
+    # Stagger the clients so their packets do not all arrive on the same tick.
+    started = loop.time() + random.uniform(0, 0.02)
+    for i in range(int(args.seconds / 0.02)):
+        target = started + i * 0.02
+        await asyncio.sleep(max(0.0, target - loop.time()))
+        lateness.append(loop.time() - target)
+        pending.put_pcm16(packet)
+    processor.cancel()
+    return pending.merged + pending.dropped
+
+
+async def _load_test(clients, inline, args, work, per_matmul_ms):
+    executor = InferenceExecutor("thread", args.workers, args.stream_workers)
+    lateness = []
+    try:
+        backlog = await asyncio.gather(
+            *(_client(executor, inline, args, lateness, work, per_matmul_ms) for _ in range(clients))
+        )
+    finally:
+        executor.shutdown()
+    return np.array(lateness) * 1000, sum(backlog)
+
+
+if __name__ == "__main__":
+    # Receive latency of concurrent streaming clients with model calls made
+    # inline on the event loop vs through InferenceExecutor, e.g.
+    #   python inference_executor.py --clients 1 10 50
+    import torch
+
+    parser = argparse.ArgumentParser(description="Load test the streaming receive path.")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--seconds", type=float, default=10.0, help="Audio streamed per client")
+    parser.add_argument("--vad-ms", type=float, default=2.0, help="Compute per VAD chunk")
+    parser.add_argument("--asr-ms", type=float, default=50.0, help="Compute per ASR segment")
+    parser.add_argument("--chunk-ms", type=int, default=300)
+    parser.add_argument("--segment-s", type=float, default=3.0)
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--stream-workers", type=int, default=4)
+    parser.add_argument("--max-pending-chunks", type=int, default=32)
+    parser.add_argument("--policy", choices=["merge", "drop"], default="merge")
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    work = torch.randn(128, 128)
+    started = time.perf_counter()
+    for _ in range(200):
+        work @ work
+    per_matmul_ms = (time.perf_counter() - started) / 200 * 1000
+
+    print(
+        f"packets every 20 ms; VAD {args.vad_ms:g} ms per {args.chunk_ms} ms chunk; "
+        f"ASR {args.asr_ms:g} ms per {args.segment_s:g}s segment; {os.cpu_count()} CPUs"
+    )
+    print(f"{'mode':>9} {'clients':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'merged/dropped':>15}")
+    for inline in (True, False):
+        for clients in args.clients:
+            lateness, backlog = asyncio.run(_load_test(clients, inline, args, work, per_matmul_ms))
+            print(
+                f"{'inline' if inline else 'executor':>9} {clients:>8} "
+                f"{np.percentile(lateness, 50):8.2f} {np.percentile(lateness, 99):8.2f} "
+                f"{lateness.max():8.2f} {backlog:>15}"
+            )
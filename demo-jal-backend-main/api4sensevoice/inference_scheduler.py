@@ -0,0 +1,168 @@
+import asyncio
+import bisect
+import time
+from collections import defaultdict
+from typing import Callable, List, Sequence
+
+from loguru import logger
+
+from bucketing import LengthBucketer, PaddingStats
+
+
+class Histogram:
+    """Fixed-bucket histogram; `bounds` are inclusive upper edges."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        labels = [f"<={b:g}" for b in self.bounds] + [f">{self.bounds[-1]:g}"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.total,
+            "mean": self.sum / self.total if self.total else 0.0,
+        }
+
+
+class _Request:
+    __slots__ = ("audio", "group", "future", "enqueued")
+
+    def __init__(self, audio, group, future):
+        self.audio = audio
+        self.group = group
+        self.future = future
+        self.enqueued = time.perf_counter()
+
+
+class InferenceScheduler:
+    """Cross-connection micro-batching for ASR inference.
+
+    Segments submitted by any connection go into one queue. A single worker task
+    takes the first pending segment, keeps collecting until `max_batch_size`
+    segments or `max_wait_ms` have elapsed, splits the batch by `group`
+    (requests with different decoding options cannot share a forward pass) and
+    runs `infer_fn(audios, *group)` once per group off the event loop. Each
+    caller's future is resolved with its own result. With a `bucketer`, a group
+    is further split by length bucket, so one long segment does not make every
+    short one in the batch pay for its padding. A failure anywhere in a batch
+    is set on that batch's futures; if the worker task itself dies it is
+    restarted on the same queue by the next `submit`.
+    """
+
+    def __init__(
+        self,
+        infer_fn: Callable[..., List[dict]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+        executor=None,
+        bucketer: LengthBucketer = None,
+    ):
+        self.infer_fn = infer_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self.bucketer = bucketer
+        self.padding = PaddingStats()
+        self.batch_size_hist = Histogram([1, 2, 4, 8, 16, 32])
+        self.queue_wait_hist = Histogram([1, 5, 10, 20, 50, 100, 250, 500, 1000])
+        self._queue = None
+        self._worker = None
+
+    def _ensure_worker(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            if self._worker is not None and not self._worker.cancelled() and self._worker.exception():
+                logger.error(f"[scheduler] worker died, restarting: {self._worker.exception()}")
+            # Restart on the same queue so requests already waiting are still served.
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, audio, *group) -> dict:
+        """Queue one segment and wait for its result."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Request(audio, group, future))
+        return await future
+
+    async def _collect(self) -> List[_Request]:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._run_batch(batch)
+            except asyncio.CancelledError:
+                for r in batch:
+                    r.future.cancel()
+                raise
+            except Exception as e:
+                # Anything outside infer_fn (bucketing, a short result list, ...)
+                # fails this batch only; the worker keeps serving the queue.
+                logger.error(f"[scheduler] batch of {len(batch)} failed: {e}")
+                for r in batch:
+                    if not r.future.done():
+                        r.future.set_exception(e)
+
+    async def _run_batch(self, batch: List[_Request]):
+        loop = asyncio.get_running_loop()
+        groups = defaultdict(list)
+        for request in batch:
+            bucket = self.bucketer.bucket(len(request.audio)) if self.bucketer else 0
+            groups[request.group, bucket].append(request)
+
+        for (group, _), requests in groups.items():
+            # Callers that went away (e.g. socket closed) no longer need a slot.
+            requests = [r for r in requests if not r.future.done()]
+            if not requests:
+                continue
+            started = time.perf_counter()
+            for r in requests:
+                self.queue_wait_hist.observe((started - r.enqueued) * 1000)
+            self.batch_size_hist.observe(len(requests))
+            self.padding.record([len(r.audio) for r in requests])
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.infer_fn, [r.audio for r in requests], *group
+                )
+                if len(results) != len(requests):
+                    raise RuntimeError(f"infer_fn returned {len(results)} results for {len(requests)} segments")
+            except Exception as e:
+                logger.error(f"[scheduler] batch of {len(requests)} failed: {e}")
+                for r in requests:
+                    if not r.future.done():
+                        r.future.set_exception(e)
+                continue
+            logger.debug(
+                f"[scheduler] batch_size: {len(requests)}; "
+                f"elapsed: {(time.perf_counter() - started) * 1000:.2f} ms"
+            )
+            for r, result in zip(requests, results):
+                if not r.future.done():
+                    r.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "batch_size": self.batch_size_hist.snapshot(),
+            "queue_wait_ms": self.queue_wait_hist.snapshot(),
+            "padding": self.padding.snapshot(),
+        }
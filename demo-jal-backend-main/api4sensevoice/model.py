@@ -7,6 +7,7 @@ import torch.nn.functional as F
 from torch import Tensor
 from torch import nn
 from torch.cuda.amp import autocast
+import torchaudio.compliance.kaldi as kaldi
 from funasr.metrics.compute_acc import compute_accuracy, th_accuracy
 from funasr.losses.label_smoothing_loss import LabelSmoothingLoss
 from funasr.train_utils.device_funcs import force_gatherable
@@ -21,23 +22,36 @@ from funasr.register import tables
 from funasr.models.paraformer.search import Hypothesis
 
 
+# torch.compiler.is_compiling is missing from some torch releases still in use
+# (requirements pin torch 2.3.0); torch._dynamo has carried it since 2.0.
+_is_compiling = getattr(torch.compiler, "is_compiling", None)
+if _is_compiling is None:
+    import torch._dynamo
+
+    _is_compiling = torch._dynamo.is_compiling
+
+
 class SinusoidalPositionEncoder(torch.nn.Module):
     """ """
 
-    def __int__(self, d_model=80, dropout_rate=0.1):
-        pass
+    def __init__(self, d_model=80, dropout_rate=0.1):
+        super().__init__()
+        # (depth, device, dtype) -> (1, max_len, depth) encodings of positions 1..max_len
+        self._tables = {}
 
     def encode(
         self, positions: torch.Tensor = None, depth: int = None, dtype: torch.dtype = torch.float32
     ):
         batch_size = positions.size(0)
-        positions = positions.type(dtype)
+        # Half / bfloat16 cannot even represent positions past 2048 / 256 exactly.
+        compute_dtype = torch.float32 if dtype in (torch.float16, torch.bfloat16) else dtype
+        positions = positions.type(compute_dtype)
         device = positions.device
-        log_timescale_increment = torch.log(torch.tensor([10000], dtype=dtype, device=device)) / (
-            depth / 2 - 1
-        )
+        log_timescale_increment = torch.log(
+            torch.tensor([10000], dtype=compute_dtype, device=device)
+        ) / (depth / 2 - 1)
         inv_timescales = torch.exp(
-            torch.arange(depth / 2, device=device).type(dtype) * (-log_timescale_increment)
+            torch.arange(depth / 2, device=device).type(compute_dtype) * (-log_timescale_increment)
         )
         inv_timescales = torch.reshape(inv_timescales, [batch_size, -1])
         scaled_time = torch.reshape(positions, [1, -1, 1]) * torch.reshape(
@@ -46,12 +60,27 @@ class SinusoidalPositionEncoder(torch.nn.Module):
         encoding = torch.cat([torch.sin(scaled_time), torch.cos(scaled_time)], dim=2)
         return encoding.type(dtype)
 
-    def forward(self, x):
+    def position_table(self, length: int, depth: int, device, dtype):
+        """Encodings of positions 1..`length`, computed once and grown by doubling."""
+        key = (depth, torch.device(device), dtype)
+        table = self._tables.get(key)
+        if table is None or table.size(1) < length:
+            max_len = max(length, 2 * table.size(1) if table is not None else 1024)
+            positions = torch.arange(1, max_len + 1, device=device)[None, :]
+            table = self.encode(positions, depth, dtype)
+            self._tables[key] = table
+        return table
+
+    def forward(self, x, offset: int = 0):
+        """Add the encodings of positions `offset + 1` .. `offset + time` to `x`."""
         batch_size, timesteps, input_dim = x.size()
-        positions = torch.arange(1, timesteps + 1, device=x.device)[None, :]
-        position_encoding = self.encode(positions, input_dim, x.dtype).to(x.device)
-
-        return x + position_encoding
+        if torch.jit.is_tracing() or _is_compiling():
+            # A cached table would be baked into the exported graph with a fixed
+            # length; under torch.compile, growing it would invalidate graphs.
+            positions = torch.arange(1, timesteps + 1, device=x.device)[None, :] + offset
+            return x + self.encode(positions, input_dim, x.dtype)
+        table = self.position_table(offset + timesteps, input_dim, x.device, x.dtype)
+        return x + table[:, offset : offset + timesteps]
 
 
 class PositionwiseFeedForward(torch.nn.Module):
@@ -85,8 +114,15 @@ class MultiHeadedAttentionSANM(nn.Module):
         n_feat (int): The number of features.
         dropout_rate (float): Dropout rate.
 
+    With `use_sdpa` (see `SenseVoiceSmall.set_sdpa`), attention with a
+    key-padding mask runs through the fused
+    `F.scaled_dot_product_attention` instead of materializing the
+    (batch, head, time1, time2) scores and probabilities.
+
     """
 
+    use_sdpa = False
+
     def __init__(
         self,
         n_head,
@@ -143,6 +179,32 @@ class MultiHeadedAttentionSANM(nn.Module):
             x = x * mask
         return x
 
+    def forward_fsmn_chunk(self, inputs, history=None, stride=None):
+        """`forward_fsmn` of a chunk that continues a stream.
+
+        `history` holds the last left-padding frames of the earlier chunks and
+        replaces the zero padding on the left, so frames at the start of the
+        chunk see the same left context as in a full-utterance pass. The right
+        edge is still zero-padded: those frames are not known yet.
+
+        Returns:
+            torch.Tensor: Output tensor (#batch, time, size).
+            torch.Tensor: History for the next chunk, taken from the first
+                `stride` frames (the rest is look-ahead seen again next time).
+        """
+        left, right = self.pad_fn.padding
+        b, t, d = inputs.size()
+        if history is None:
+            history = inputs.new_zeros(b, left, d)
+        context = torch.cat((history, inputs), dim=1)
+        x = F.pad(context.transpose(1, 2), (0, right))
+        x = self.fsmn_block(x)
+        x = x.transpose(1, 2)
+        x = x + inputs
+        x = self.dropout(x)
+        stride = t if stride is None else stride
+        return x, context[:, stride : left + stride]
+
     def forward_qkv(self, x):
         """Transform query, key and value.
 
@@ -210,6 +272,28 @@ class MultiHeadedAttentionSANM(nn.Module):
 
         return self.linear_out(x)  # (batch, time1, d_model)
 
+    def forward_sdpa(self, q_h, k_h, v_h, mask):
+        """`forward_attention` of unscaled q/k/v with a fused kernel.
+
+        Args:
+            mask (torch.Tensor): Key-padding mask (#batch, 1, time2) or None.
+
+        Returns:
+            torch.Tensor: Output tensor (#batch, time1, d_model).
+
+        """
+        n_batch = v_h.size(0)
+        attn_mask = None if mask is None else mask.unsqueeze(1).bool()  # (batch, 1, 1, time2)
+        x = F.scaled_dot_product_attention(
+            q_h,
+            k_h,
+            v_h,
+            attn_mask=attn_mask,
+            dropout_p=self.dropout.p if self.training else 0.0,
+        )  # (batch, head, time1, d_k)
+        x = x.transpose(1, 2).reshape(n_batch, -1, self.h * self.d_k)
+        return self.linear_out(x)
+
     def forward(self, x, mask, mask_shfit_chunk=None, mask_att_chunk_encoder=None):
         """Compute scaled dot product attention.
 
@@ -226,6 +310,14 @@ class MultiHeadedAttentionSANM(nn.Module):
         """
         q_h, k_h, v_h, v = self.forward_qkv(x)
         fsmn_memory = self.forward_fsmn(v, mask, mask_shfit_chunk)
+        if (
+            self.use_sdpa
+            and mask_att_chunk_encoder is None
+            and (mask is None or mask.size(1) == 1)
+        ):
+            # Only key-padding masks: no query row is fully masked, so the
+            # fused softmax matches the masked_fill path exactly.
+            return self.forward_sdpa(q_h, k_h, v_h, mask) + fsmn_memory
         q_h = q_h * self.d_k ** (-0.5)
         scores = torch.matmul(q_h, k_h.transpose(-2, -1))
         att_outs = self.forward_attention(v_h, scores, mask, mask_att_chunk_encoder)
@@ -246,10 +338,13 @@ class MultiHeadedAttentionSANM(nn.Module):
 
         """
         q_h, k_h, v_h, v = self.forward_qkv(x)
+        fsmn_history = None if cache is None else cache.get("fsmn")
         if chunk_size is not None and look_back > 0 or look_back == -1:
             if cache is not None:
-                k_h_stride = k_h[:, :, : -(chunk_size[2]), :]
-                v_h_stride = v_h[:, :, : -(chunk_size[2]), :]
+                # chunk_size[2] look-ahead frames are recomputed with the next chunk.
+                stride = k_h.size(2) - chunk_size[2]
+                k_h_stride = k_h[:, :, :stride, :]
+                v_h_stride = v_h[:, :, :stride, :]
                 k_h = torch.cat((cache["k"], k_h), dim=2)
                 v_h = torch.cat((cache["v"], v_h), dim=2)
 
@@ -259,12 +354,22 @@ class MultiHeadedAttentionSANM(nn.Module):
                     cache["k"] = cache["k"][:, :, -(look_back * chunk_size[1]) :, :]
                     cache["v"] = cache["v"][:, :, -(look_back * chunk_size[1]) :, :]
             else:
+                stride = k_h.size(2) - chunk_size[2]
                 cache_tmp = {
-                    "k": k_h[:, :, : -(chunk_size[2]), :],
-                    "v": v_h[:, :, : -(chunk_size[2]), :],
+                    "k": k_h[:, :, :stride, :],
+                    "v": v_h[:, :, :stride, :],
                 }
                 cache = cache_tmp
-        fsmn_memory = self.forward_fsmn(v, None)
+        # Like the keys and values, the FSMN memory continues from the
+        # previous chunk instead of restarting from zero padding.
+        fsmn_memory, fsmn_history = self.forward_fsmn_chunk(
+            v, fsmn_history, None if chunk_size is None else v.size(1) - chunk_size[2]
+        )
+        if cache is None:
+            cache = {}
+        cache["fsmn"] = fsmn_history
+        if self.use_sdpa:
+            return self.forward_sdpa(q_h, k_h, v_h, None) + fsmn_memory, cache
         q_h = q_h * self.d_k ** (-0.5)
         scores = torch.matmul(q_h, k_h.transpose(-2, -1))
         att_outs = self.forward_attention(v_h, scores, None)
@@ -276,6 +381,10 @@ class LayerNorm(nn.LayerNorm):
         super().__init__(*args, **kwargs)
 
     def forward(self, input):
+        if self.weight is None or input.dtype == self.weight.dtype:
+            # The kernel accumulates mean / variance in float32 for half and
+            # bfloat16 inputs, so there is no need to copy input and weights.
+            return F.layer_norm(input, self.normalized_shape, self.weight, self.bias, self.eps)
         output = F.layer_norm(
             input.float(),
             self.normalized_shape,
@@ -549,13 +658,24 @@ class SenseVoiceEncoderSmall(nn.Module):
     def output_size(self) -> int:
         return self._output_size
 
+    def set_sdpa(self, enabled: bool = True):
+        """Run every SANM attention layer through the fused SDPA kernel (or not)."""
+        for module in self.modules():
+            if isinstance(module, MultiHeadedAttentionSANM):
+                module.use_sdpa = enabled
+        return self
+
     def forward(
         self,
         xs_pad: torch.Tensor,
         ilens: torch.Tensor,
     ):
         """Embed positions in tensor."""
-        masks = sequence_mask(ilens, device=ilens.device)[:, None, :]
+        # maxlen from the input shape: no data-dependent `ilens.max()`, and
+        # inputs padded past the longest utterance (see cpu_backend) still work.
+        masks = sequence_mask(
+            ilens, maxlen=xs_pad.size(1), dtype=xs_pad.dtype, device=ilens.device
+        )[:, None, :]
 
         xs_pad *= self.output_size() ** 0.5
 
@@ -573,7 +693,7 @@ class SenseVoiceEncoderSmall(nn.Module):
         xs_pad = self.after_norm(xs_pad)
 
         # forward encoder2
-        olens = masks.squeeze(1).sum(1).int()
+        olens = (masks.squeeze(1) > 0).sum(1).int()  # exact even for bfloat16 masks
 
         for layer_idx, encoder_layer in enumerate(self.tp_encoders):
             encoder_outs = encoder_layer(xs_pad, masks)
@@ -582,6 +702,47 @@ class SenseVoiceEncoderSmall(nn.Module):
         xs_pad = self.tp_norm(xs_pad)
         return xs_pad, olens
 
+    def forward_chunk(self, xs_pad: torch.Tensor, cache: dict, look_back: int = -1):
+        """Encode the next chunk of a stream.
+
+        Keys and values of earlier chunks are kept per layer in `cache`, so each
+        call only runs the new frames through the encoder while still attending
+        to `look_back` previous chunks (-1 for all of them). The FSMN memory
+        likewise keeps the left context of each layer; only the frames at the
+        end of a chunk differ from a full pass, as their right context is
+        zero-padded until the next chunk arrives.
+
+        Args:
+            xs_pad: Features of the new frames (1, time, input_size).
+            cache: Dict owned by the caller, empty at the start of a stream.
+
+        Returns:
+            torch.Tensor: Encoder output of the new frames (1, time, output_size).
+        """
+        offset = cache.get("offset", 0)
+        layers = list(self.encoders0) + list(self.encoders)
+        layer_caches = cache.setdefault("layers", [None] * len(layers))
+        tp_caches = cache.setdefault("tp_layers", [None] * len(self.tp_encoders))
+        chunk_size = [0, xs_pad.size(1), 0]
+
+        xs_pad = xs_pad * self.output_size() ** 0.5
+        xs_pad = self.embed(xs_pad, offset=offset)
+
+        for i, encoder_layer in enumerate(layers):
+            xs_pad, layer_caches[i] = encoder_layer.forward_chunk(
+                xs_pad, layer_caches[i], chunk_size, look_back
+            )
+        xs_pad = self.after_norm(xs_pad)
+
+        for i, encoder_layer in enumerate(self.tp_encoders):
+            xs_pad, tp_caches[i] = encoder_layer.forward_chunk(
+                xs_pad, tp_caches[i], chunk_size, look_back
+            )
+        xs_pad = self.tp_norm(xs_pad)
+
+        cache["offset"] = offset + chunk_size[1]
+        return xs_pad
+
 
 @tables.register("model_classes", "SenseVoiceSmall")
 class SenseVoiceSmall(nn.Module):
@@ -804,6 +965,29 @@ class SenseVoiceSmall(nn.Module):
 
         return loss_rich, acc_rich
 
+    def prompt_ids(self, language="auto", use_itn=False, text_norm=None):
+        """Embedding ids of the language and text-norm prompts."""
+        textnorm = text_norm
+        if textnorm is None:
+            textnorm = "withitn" if use_itn else "woitn"
+        return self.lid_dict.get(language, 0), self.textnorm_dict[textnorm]
+
+    def prompt_queries(
+        self, batch_size: int, device, language="auto", use_itn=False, text_norm=None
+    ):
+        """Embeddings of the language, event, emotion and text-norm prompts.
+
+        They are prepended to the features; their encoder outputs decode to the
+        `<|lang|><|emo|><|event|><|itn|>` tags at the start of every result.
+        """
+        language_id, textnorm_id = self.prompt_ids(language, use_itn, text_norm)
+        language_query = self.embed(torch.LongTensor([[language_id]]).to(device))
+        textnorm_query = self.embed(torch.LongTensor([[textnorm_id]]).to(device))
+
+        event_emo_query = self.embed(torch.LongTensor([[1, 2]]).to(device))
+        input_query = torch.cat((language_query, event_emo_query, textnorm_query), dim=1)
+        return input_query.repeat(batch_size, 1, 1)
+
     def inference(
         self,
         data_in,
@@ -844,32 +1028,22 @@ class SenseVoiceSmall(nn.Module):
                 speech_lengths.sum().item() * frontend.frame_shift * frontend.lfr_n / 1000
             )
 
-        speech = speech.to(device=kwargs["device"])
-        speech_lengths = speech_lengths.to(device=kwargs["device"])
-
-        language = kwargs.get("language", "auto")
-        language_query = self.embed(
-            torch.LongTensor([[self.lid_dict[language] if language in self.lid_dict else 0]]).to(
-                speech.device
-            )
-        ).repeat(speech.size(0), 1, 1)
-
-        use_itn = kwargs.get("use_itn", False)
-        textnorm = kwargs.get("text_norm", None)
-        if textnorm is None:
-            textnorm = "withitn" if use_itn else "woitn"
-        textnorm_query = self.embed(
-            torch.LongTensor([[self.textnorm_dict[textnorm]]]).to(speech.device)
-        ).repeat(speech.size(0), 1, 1)
-        speech = torch.cat((textnorm_query, speech), dim=1)
-        speech_lengths += 1
+        results = self.forward_decode(
+            speech, speech_lengths, key, tokenizer, frontend, meta_data, **kwargs
+        )
+        return results, meta_data
 
-        event_emo_query = self.embed(torch.LongTensor([[1, 2]]).to(speech.device)).repeat(
-            speech.size(0), 1, 1
+    def ctc_logits(self, speech: torch.Tensor, speech_lengths: torch.Tensor, **kwargs):
+        """Prompt embeddings + encoder + CTC log-softmax over a padded feature batch."""
+        input_query = self.prompt_queries(
+            speech.size(0),
+            speech.device,
+            kwargs.get("language", "auto"),
+            kwargs.get("use_itn", False),
+            kwargs.get("text_norm", None),
         )
-        input_query = torch.cat((language_query, event_emo_query), dim=1)
         speech = torch.cat((input_query, speech), dim=1)
-        speech_lengths += 3
+        speech_lengths = speech_lengths + 4
 
         # Encoder
         encoder_out, encoder_out_lens = self.encoder(speech, speech_lengths)
@@ -880,45 +1054,499 @@ class SenseVoiceSmall(nn.Module):
         ctc_logits = self.ctc.log_softmax(encoder_out)
         if kwargs.get("ban_emo_unk", False):
             ctc_logits[:, :, self.emo_dict["unk"]] = -float("inf")
+        return ctc_logits, encoder_out_lens
 
-        results = []
-        b, n, d = encoder_out.size()
+    def forward_decode(
+        self,
+        speech: torch.Tensor,
+        speech_lengths: torch.Tensor,
+        key: list,
+        tokenizer,
+        frontend,
+        meta_data: dict,
+        **kwargs,
+    ):
+        """Encode a feature batch and decode it; timings are added to `meta_data`.
+
+        `logits_fn` in kwargs replaces `ctc_logits`, e.g. with an exported or
+        quantized copy of the encoder (see cpu_backend.py).
+        """
+        speech = speech.to(device=kwargs["device"])
+        speech_lengths = speech_lengths.to(device=kwargs["device"])
+
+        time1 = time.perf_counter()
+        logits_fn = kwargs.get("logits_fn") or self.ctc_logits
+        ctc_logits, encoder_out_lens = logits_fn(speech, speech_lengths, **kwargs)
+        if ctc_logits.is_cuda:
+            torch.cuda.synchronize(ctc_logits.device)
+        time2 = time.perf_counter()
+        meta_data["encode"] = f"{time2 - time1:0.3f}"
+
+        b = ctc_logits.size(0)
         if isinstance(key[0], (list, tuple)):
             key = key[0]
         if len(key) < b:
             key = key * b
-        for i in range(b):
-            x = ctc_logits[i, : encoder_out_lens[i].item(), :]
-            yseq = x.argmax(dim=-1)
-            yseq = torch.unique_consecutive(yseq, dim=-1)
 
-            ibest_writer = None
-            if kwargs.get("output_dir") is not None:
-                if not hasattr(self, "writer"):
-                    self.writer = DatadirWriter(kwargs.get("output_dir"))
-                ibest_writer = self.writer[f"1best_recog"]
+        ibest_writer = None
+        if kwargs.get("output_dir") is not None:
+            if not hasattr(self, "writer"):
+                self.writer = DatadirWriter(kwargs.get("output_dir"))
+            ibest_writer = self.writer[f"1best_recog"]
+
+        frame_shift_ms = frontend.frame_shift * frontend.lfr_n if frontend is not None else 60
+        results = self.decode_ctc_batch(
+            ctc_logits,
+            encoder_out_lens,
+            tokenizer,
+            key,
+            output_timestamp=kwargs.get("output_timestamp", False),
+            frame_shift_ms=frame_shift_ms,
+        )
+        if ibest_writer is not None:
+            for result_i in results:
+                ibest_writer["text"][result_i["key"]] = result_i["text"]
+        meta_data["decode"] = f"{time.perf_counter() - time2:0.3f}"
+
+        return results
+
+    @staticmethod
+    def extract_fbank_batch(waveforms: list, frontend):
+        """fbank + LFR + CMVN for a list of 1-D waveforms, as `frontend` would compute it.
+
+        Fbank itself is computed per waveform (kaldi fbank takes one signal), but
+        LFR stacking and CMVN run once over the padded batch with a single gather
+        instead of a Python loop per utterance.
+
+        Returns:
+            torch.Tensor: Features (#batch, time, n_mels * lfr_m), zero padded.
+            torch.Tensor: Feature lengths (#batch,).
+        """
+        fbanks = []
+        for waveform in waveforms:
+            if frontend.upsacle_samples:
+                waveform = waveform * (1 << 15)
+            fbanks.append(
+                kaldi.fbank(
+                    waveform[None, :],
+                    num_mel_bins=frontend.n_mels,
+                    frame_length=min(frontend.frame_length, waveform.numel() / frontend.fs * 1000),
+                    frame_shift=frontend.frame_shift,
+                    dither=frontend.dither,
+                    energy_floor=0.0,
+                    window_type=frontend.window,
+                    sample_frequency=frontend.fs,
+                    snip_edges=frontend.snip_edges,
+                )
+            )
+        fbank_lengths = torch.tensor([f.size(0) for f in fbanks])
+        fbank = torch.nn.utils.rnn.pad_sequence(fbanks, batch_first=True)
+        batch_size, _, n_mels = fbank.size()
+
+        lfr_m, lfr_n = frontend.lfr_m, frontend.lfr_n
+        lengths = (fbank_lengths + lfr_n - 1) // lfr_n
+        # Output frame i stacks input frames i*lfr_n - (lfr_m-1)//2 ... + lfr_m - 1;
+        # indices outside the utterance repeat its first / last frame.
+        index = (
+            torch.arange(int(lengths.max()))[:, None] * lfr_n
+            + torch.arange(lfr_m)[None, :]
+            - (lfr_m - 1) // 2
+        )
+        index = torch.minimum(index.clamp(min=0)[None], (fbank_lengths - 1)[:, None, None])
+        feats = torch.gather(
+            fbank, 1, index.reshape(batch_size, -1, 1).expand(-1, -1, n_mels)
+        ).reshape(batch_size, index.size(1), lfr_m * n_mels)
+
+        if frontend.cmvn is not None:
+            dim = feats.size(-1)
+            feats = (feats + frontend.cmvn[0:1, :dim]) * frontend.cmvn[1:2, :dim]
+        feats = feats * (torch.arange(feats.size(1))[None, :] < lengths[:, None])[..., None]
+        return feats.type(torch.float32), lengths.to(torch.int32)
+
+    def transcribe_pcm(
+        self,
+        audios: list,
+        key: list = None,
+        tokenizer=None,
+        frontend=None,
+        **kwargs,
+    ):
+        """Transcribe float32 PCM (mono, `frontend.fs`, range [-1, 1]) directly.
 
-            mask = yseq != self.blank_id
-            token_int = yseq[mask].tolist()
+        Skips the generic input sniffing of `load_audio_text_image_video`:
+        float32 numpy arrays are wrapped with `torch.from_numpy` without a copy
+        and the front end runs batched (see `extract_fbank_batch`).
+
+        Returns:
+            list: One result dict per input, as `inference` returns them.
+            dict: Timings of `load_data`, `extract_feat`, `encode` and `decode`.
+        """
+        meta_data = {}
+        time1 = time.perf_counter()
+        waveforms = [
+            torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32))
+            if isinstance(audio, np.ndarray)
+            else audio
+            for audio in audios
+        ]
+        time2 = time.perf_counter()
+        meta_data["load_data"] = f"{time2 - time1:0.3f}"
+        speech, speech_lengths = self.extract_fbank_batch(waveforms, frontend)
+        time3 = time.perf_counter()
+        meta_data["extract_feat"] = f"{time3 - time2:0.3f}"
+        meta_data["batch_data_time"] = (
+            speech_lengths.sum().item() * frontend.frame_shift * frontend.lfr_n / 1000
+        )
+
+        if key is None:
+            key = [f"pcm_{i}" for i in range(len(audios))]
+        kwargs.setdefault("device", next(self.parameters()).device)
+        results = self.forward_decode(
+            speech, speech_lengths, key, tokenizer, frontend, meta_data, **kwargs
+        )
+        return results, meta_data
+
+    def decode_ctc_batch(
+        self,
+        ctc_logits: torch.Tensor,
+        encoder_out_lens: torch.Tensor,
+        tokenizer,
+        key: list,
+        output_timestamp: bool = False,
+        frame_shift_ms: float = 60,
+    ):
+        """Greedy CTC decoding of a whole batch.
+
+        Argmax, collapse of repeats, blank removal and the average frame logprob
+        are computed for all utterances with a few tensor ops, and everything
+        needed on the host is copied back in one transfer.
+
+        Args:
+            ctc_logits: Log-probabilities (#batch, time, vocab).
+            encoder_out_lens: Valid frames per utterance (#batch,).
+            output_timestamp: Also return per-token ids, [begin, end] times in
+                milliseconds (relative to the speech, i.e. after the 4 prompt
+                frames) and the logprob of the frame that emitted each token.
+
+        Returns:
+            list: One result dict per utterance.
+        """
+        b, n, _ = ctc_logits.size()
+        logprobs, yseq = ctc_logits.max(dim=-1)  # (batch, time)
+        lens = encoder_out_lens.to(yseq.device)
+        valid = torch.arange(n, device=yseq.device)[None, :] < lens[:, None]
+        emit = valid & (yseq != self.blank_id)
+        emit[:, 1:] &= yseq[:, 1:] != yseq[:, :-1]
+        avg_logprob = (logprobs * valid).sum(dim=-1) / lens.clamp(min=1)
+
+        # Token ids are < 2**24, so they survive the float32 round trip exactly.
+        packed = torch.cat(
+            (
+                yseq.float(),
+                emit.float(),
+                logprobs.float(),
+                avg_logprob.float()[:, None],
+                lens.float()[:, None],
+            ),
+            dim=1,
+        ).cpu().numpy()
+        yseq_h = packed[:, :n].astype(np.int64)
+        emit_h = packed[:, n : 2 * n] > 0
+        logprobs_h = packed[:, 2 * n : 3 * n]
+
+        results = []
+        for i in range(b):
+            frames = np.flatnonzero(emit_h[i])
+            token_int = yseq_h[i, frames].tolist()
 
             # Change integer-ids to tokens
             text = tokenizer.decode(token_int)
 
-            # 计算所有logprob的平均值
-            avg_logprob = x.max(dim=-1)[0].mean().item()
-            
-            result_i = {"key": key[i], "text": text, "avg_logprob": avg_logprob}
+            result_i = {"key": key[i], "text": text, "avg_logprob": float(packed[i, 3 * n])}
+            if output_timestamp:
+                length = int(packed[i, 3 * n + 1])
+                # A token lasts until the frame where the argmax changes.
+                changes = np.flatnonzero(np.diff(yseq_h[i, :length])) + 1
+                ends = np.append(changes, length)[np.searchsorted(changes, frames, side="right")]
+                result_i["token_ids"] = token_int
+                result_i["timestamps"] = [
+                    [max(beg - 4, 0) * frame_shift_ms, max(end - 4, 0) * frame_shift_ms]
+                    for beg, end in zip(frames.tolist(), ends.tolist())
+                ]
+                result_i["token_logprobs"] = logprobs_h[i, frames].tolist()
             results.append(result_i)
 
-            if ibest_writer is not None:
-                ibest_writer["text"][key[i]] = text
+        return results
 
-        return results, meta_data
+    def inference_chunk(
+        self,
+        audio,
+        cache: dict,
+        tokenizer=None,
+        frontend=None,
+        **kwargs,
+    ):
+        """Partial transcription of a growing speech segment.
+
+        `audio` is the whole segment received so far; `cache` is owned by the
+        caller and must be cleared when the segment ends. Only features that were
+        not encoded by a previous call go through the encoder (see
+        `SenseVoiceEncoderSmall.forward_chunk`), and the greedy CTC path is
+        extended rather than recomputed, so each call costs about one chunk.
+        The result is a hypothesis for display; the final transcript should come
+        from `inference` over the complete segment.
+        """
+        device = kwargs.get("device", None) or next(self.parameters()).device
+        hop = int(frontend.fs * frontend.frame_shift / 1000)
+        done = cache.get("frames", 0)
+
+        # LFR frame i stacks fbank frames [i*lfr_n - 3, i*lfr_n + 3]. Starting
+        # one LFR frame early reproduces frame `done` exactly after dropping the
+        # first output, and the last output frame is held back because it is
+        # padded until more audio arrives.
+        start_frame = max(done - 1, 0)
+        tail = audio[start_frame * frontend.lfr_n * hop :]
+        if isinstance(tail, np.ndarray):
+            tail = torch.from_numpy(tail)
+        if tail.numel() < int(frontend.fs * frontend.frame_length / 1000):
+            return cache.get("result", {"text": ""})
+        speech, speech_lengths = self.extract_fbank_batch([tail], frontend)
+        speech = speech[:, (1 if done else 0) : int(speech_lengths[0]) - 1, :]
+        if speech.size(1) == 0:
+            return cache.get("result", {"text": ""})
+        cache["frames"] = done + speech.size(1)
+
+        speech = speech.to(device=device)
+        if "encoder" not in cache:
+            input_query = self.prompt_queries(
+                1,
+                device,
+                kwargs.get("language", "auto"),
+                kwargs.get("use_itn", False),
+                kwargs.get("text_norm", None),
+            )
+            speech = torch.cat((input_query, speech), dim=1)
+        encoder_out = self.encoder.forward_chunk(
+            speech, cache.setdefault("encoder", {}), look_back=kwargs.get("look_back", -1)
+        )
+
+        ctc_logits = self.ctc.log_softmax(encoder_out)[0]
+        if kwargs.get("ban_emo_unk", False):
+            ctc_logits[:, self.emo_dict["unk"]] = -float("inf")
+        logprobs, yseq = ctc_logits.max(dim=-1)
+
+        tokens = cache.setdefault("tokens", [])
+        prev = cache.get("last_id", None)
+        for token in yseq.tolist():
+            if token != prev and token != self.blank_id:
+                tokens.append(token)
+            prev = token
+        cache["last_id"] = prev
+        cache["logprob_sum"] = cache.get("logprob_sum", 0.0) + logprobs.sum().item()
+        cache["num_frames"] = cache.get("num_frames", 0) + yseq.numel()
+
+        cache["result"] = {
+            "text": tokenizer.decode(tokens),
+            "avg_logprob": cache["logprob_sum"] / cache["num_frames"],
+        }
+        return cache["result"]
+
+    def set_sdpa(self, enabled: bool = True):
+        """Run every SANM attention layer through the fused SDPA kernel (or not)."""
+        self.encoder.set_sdpa(enabled)
+        return self
 
     def export(self, **kwargs):
-        from .export_meta import export_rebuild_model
+        """Return an export-friendly wrapper (see `SenseVoiceSmallExport`)."""
+        return SenseVoiceSmallExport(self, **kwargs)
+
+
+class SenseVoiceSmallExport(torch.nn.Module):
+    """SenseVoiceSmall as a pure tensor function for ONNX / TorchScript export.
+
+    Takes features and the language / text-norm prompt ids (one per utterance)
+    and returns the CTC log-probabilities and their lengths, i.e. what
+    `SenseVoiceSmall.ctc_logits` computes. Front end and decoding stay in
+    Python. Also provides the `export_*` hooks used by funasr's exporter.
+    """
+
+    export_name = "model"
+
+    def __init__(self, model: SenseVoiceSmall, **kwargs):
+        super().__init__()
+        self.model = model
+        self.input_size = model.encoder.encoders0[0].in_size
+
+    def forward(
+        self,
+        speech: torch.Tensor,
+        speech_lengths: torch.Tensor,
+        language: torch.Tensor,
+        textnorm: torch.Tensor,
+    ):
+        language_query = self.model.embed(language)[:, None, :]
+        textnorm_query = self.model.embed(textnorm)[:, None, :]
+        event_emo_query = self.model.embed(
+            torch.tensor([1, 2], dtype=torch.long, device=speech.device)
+        )[None].expand(speech.size(0), -1, -1)
+        speech = torch.cat((language_query, event_emo_query, textnorm_query, speech), dim=1)
+        speech_lengths = speech_lengths + 4
+
+        encoder_out, encoder_out_lens = self.model.encoder(speech, speech_lengths)
+        if isinstance(encoder_out, tuple):
+            encoder_out = encoder_out[0]
+        return self.model.ctc.log_softmax(encoder_out), encoder_out_lens
+
+    def export_dummy_inputs(self):
+        speech = torch.randn(2, 30, self.input_size)
+        speech_lengths = torch.tensor([30, 20], dtype=torch.int32)
+        language = torch.tensor([0, 3], dtype=torch.long)
+        textnorm = torch.tensor([15, 15], dtype=torch.long)
+        return speech, speech_lengths, language, textnorm
+
+    def export_input_names(self):
+        return ["speech", "speech_lengths", "language", "textnorm"]
+
+    def export_output_names(self):
+        return ["ctc_logits", "encoder_out_lens"]
+
+    def export_dynamic_axes(self):
+        return {
+            "speech": {0: "batch_size", 1: "feats_length"},
+            "speech_lengths": {0: "batch_size"},
+            "language": {0: "batch_size"},
+            "textnorm": {0: "batch_size"},
+            "ctc_logits": {0: "batch_size", 1: "logits_length"},
+            "encoder_out_lens": {0: "batch_size"},
+        }
 
-        if "max_seq_len" not in kwargs:
-            kwargs["max_seq_len"] = 512
-        models = export_rebuild_model(model=self, **kwargs)
-        return models
\ No newline at end of file
+
+if __name__ == "__main__":
+    # Parity, latency and peak memory of the fused SDPA attention against the
+    # masked_fill path, on a SenseVoiceSmall-sized encoder with random weights.
+    # With --wavs, how close the streaming partial transcripts of real
+    # recordings get to the final ones instead, e.g.
+    #   python model.py --wavs speaker/*.wav --chunk-ms 300
+    import argparse
+
+    def _peak_rss_growth(fn):
+        """Run `fn` and return (result, peak RSS growth in bytes, or None)."""
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")  # reset the VmHWM high-water mark
+        except OSError:
+            return fn(), None
+
+        def read_status(key):
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith(key):
+                        return int(line.split()[1]) * 1024
+
+        before = read_status("VmRSS:")
+        result = fn()
+        return result, read_status("VmHWM:") - before
+
+    def _partial_agreement(wavs, chunk_ms, min_agreement):
+        """Stream each recording through `inference_chunk` in `chunk_ms` steps
+        and compare the last partial transcript with `transcribe_pcm`."""
+        import soundfile as sf
+        from funasr import AutoModel
+        from cpu_backend import _edit_distance
+
+        model_asr = AutoModel(
+            model="iic/SenseVoiceSmall",
+            trust_remote_code=True,
+            remote_code="./model.py",
+            device="cpu",
+            disable_update=True,
+        )
+        model = model_asr.model.eval()
+        tokenizer = model_asr.kwargs["tokenizer"]
+        frontend = model_asr.kwargs["frontend"]
+        step = int(frontend.fs * chunk_ms / 1000)
+        errors = chars = 0
+        for path in wavs:
+            audio = sf.read(path, dtype="float32")[0]
+            cache = {}
+            with torch.inference_mode():
+                for end in range(step, len(audio) + step, step):
+                    partial = model.inference_chunk(
+                        audio[:end], cache, tokenizer=tokenizer, frontend=frontend, device="cpu"
+                    )
+                final = model.transcribe_pcm(
+                    [audio], tokenizer=tokenizer, frontend=frontend, device="cpu"
+                )[0][0]
+            distance = _edit_distance(partial["text"], final["text"])
+            errors += distance
+            chars += len(final["text"])
+            print(f"{path}: {distance}/{len(final['text'])} characters differ")
+            print(f"  partial: {partial['text']}\n    final: {final['text']}")
+        agreement = 1 - errors / max(1, chars)
+        print(f"partial/final agreement over {len(wavs)} files at {chunk_ms} ms chunks: {agreement:.4f}")
+        assert agreement >= min_agreement, (
+            f"partial transcripts regressed: agreement {agreement:.4f} < {min_agreement:g}"
+        )
+
+    parser = argparse.ArgumentParser(description="Compare SDPA and matmul attention.")
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--wavs", nargs="*", default=[], help="Check partial transcripts instead")
+    parser.add_argument("--chunk-ms", type=int, default=300)
+    parser.add_argument("--min-agreement", type=float, default=0.8)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.wavs:
+        _partial_agreement(args.wavs, args.chunk_ms, args.min_agreement)
+
+    else:
+        torch.manual_seed(0)
+        encoder = SenseVoiceEncoderSmall(
+            input_size=560, output_size=512, attention_heads=4, linear_units=2048,
+            num_blocks=50, tp_blocks=20, kernel_size=11,
+        ).eval()
+
+        frames = int(args.seconds / 0.06)  # fbank frames after LFR
+        xs = torch.randn(args.batch_size, frames, 560)
+        # Mixed lengths, so the key-padding mask matters.
+        lens = torch.linspace(frames // 4, frames, args.batch_size).long()
+        for name, enabled in (("matmul", False), ("sdpa", True)):
+            encoder.set_sdpa(enabled)
+            with torch.inference_mode():
+                _, peak = _peak_rss_growth(lambda: encoder(xs, lens))
+                elapsed = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    encoder(xs, lens)
+                    elapsed.append(time.perf_counter() - started)
+            print(
+                f"{name:>6}: {args.batch_size} x {args.seconds:g}s; "
+                f"latency {np.median(elapsed):.2f}s; "
+                f"peak RSS growth {'n/a' if peak is None else f'{peak / 2**20:.0f} MiB'}"
+            )
+
+        # Parity in float64: 70 random-weight blocks amplify float32 rounding
+        # (a 1e-7 input perturbation moves the output by ~0.1), which would hide
+        # any real difference between the two paths.
+        encoder.double()
+        xs, lens = xs[:, : frames // 4].double(), (lens // 4).clamp(min=1)
+        valid = (torch.arange(xs.size(1))[None, :] < lens[:, None])[..., None]
+        outputs = {}
+        for enabled in (False, True):
+            encoder.set_sdpa(enabled)
+            with torch.inference_mode():
+                outputs[enabled] = (encoder(xs, lens)[0], encoder.forward_chunk(xs[:1], {}))
+        (ref, ref_chunk), (out, out_chunk) = outputs[False], outputs[True]
+        max_diff = ((out - ref).abs() * valid).max().item()
+        max_chunk_diff = (out_chunk - ref_chunk).abs().max().item()
+        print(f"float64 max |diff| over valid frames: {max_diff:.2e}; forward_chunk: {max_chunk_diff:.2e}")
+        # Both paths compute the same float64 attention; anything above rounding
+        # noise means the SDPA mask or scaling diverged.
+        max_abs_diff = 1e-5
+        assert max_diff <= max_abs_diff and max_chunk_diff <= max_abs_diff, (
+            f"SDPA parity regression: {max_diff:.2e} / {max_chunk_diff:.2e} > {max_abs_diff:g}"
+        )
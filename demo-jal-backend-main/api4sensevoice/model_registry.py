@@ -0,0 +1,183 @@
+import os
+import resource
+import threading
+import time
+from typing import Callable
+
+from loguru import logger
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs: fall back to the peak, in kilobytes on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ModelDisabledError(RuntimeError):
+    pass
+
+
+class ModelLoadError(RuntimeError):
+    pass
+
+
+class _Entry:
+    __slots__ = (
+        "name",
+        "loader",
+        "warmup",
+        "enabled",
+        "state",
+        "model",
+        "error",
+        "exc",
+        "failed_at",
+        "load_s",
+        "warmup_s",
+        "rss_delta",
+        "lock",
+    )
+
+    def __init__(self, name, loader, warmup, enabled):
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.enabled = enabled
+        self.state = "unloaded" if enabled else "disabled"
+        self.model = None
+        self.error = None
+        self.exc = None
+        self.failed_at = None
+        self.load_s = None
+        self.warmup_s = None
+        self.rss_delta = None
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """Named models built on first use.
+
+    `register` only records a loader; the model is built by the first `get`
+    (from any thread, others wait for it), or up front by `load_all`. After
+    loading, the optional `warmup(model)` hook runs once so the first real
+    request does not pay for lazy initialization inside the model. Load time,
+    warm-up time and the RSS growth seen while loading are kept per model and
+    reported by `status`.
+
+    A failed load is remembered: for `retry_s` seconds every `get` raises
+    `ModelLoadError` at once instead of retrying the loader under the lock.
+    `reload` retries immediately.
+    """
+
+    def __init__(self, retry_s: float = 60.0):
+        self.retry_s = retry_s
+        self._entries = {}
+
+    def register(
+        self,
+        name: str,
+        loader: Callable[[], object],
+        warmup: Callable[[object], None] = None,
+        enabled: bool = True,
+    ):
+        self._entries[name] = _Entry(name, loader, warmup, enabled)
+
+    def check(self, names):
+        unknown = set(names) - set(self._entries)
+        if unknown:
+            raise ValueError(f"Unknown models: {sorted(unknown)}")
+
+    def enabled(self, name: str) -> bool:
+        return self._entries[name].enabled
+
+    def get(self, name: str):
+        entry = self._entries[name]
+        if entry.state == "ready":
+            return entry.model
+        if not entry.enabled:
+            raise ModelDisabledError(f"model {name} is disabled")
+        self._check_failed(entry)
+        with entry.lock:
+            if entry.state != "ready":
+                # Threads that waited on a failing load see its error, not a new attempt.
+                self._check_failed(entry)
+                self._load(entry)
+        return entry.model
+
+    def reload(self, name: str):
+        """Load `name` again now, also while a failed load is backing off."""
+        entry = self._entries[name]
+        if not entry.enabled:
+            raise ModelDisabledError(f"model {name} is disabled")
+        with entry.lock:
+            self._load(entry)
+        return entry.model
+
+    def _check_failed(self, entry: _Entry):
+        if entry.state == "failed" and time.monotonic() - entry.failed_at < self.retry_s:
+            raise ModelLoadError(f"model {entry.name} failed to load: {entry.error}") from entry.exc
+
+    def _load(self, entry: _Entry):
+        entry.state = "loading"
+        entry.error = None
+        entry.exc = None
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        try:
+            model = entry.loader()
+            entry.load_s = time.perf_counter() - started
+            entry.rss_delta = rss_bytes() - rss_before
+            if entry.warmup is not None:
+                started = time.perf_counter()
+                entry.warmup(model)
+                entry.warmup_s = time.perf_counter() - started
+        except Exception as e:
+            entry.state = "failed"
+            entry.error = str(e)
+            entry.exc = e
+            entry.failed_at = time.monotonic()
+            logger.error(f"[models] {entry.name} failed to load: {e}")
+            raise
+        entry.model = model
+        entry.state = "ready"
+        logger.info(
+            f"[models] {entry.name} ready; load: {entry.load_s:.2f}s; "
+            f"warmup: {entry.warmup_s or 0:.2f}s; rss: +{entry.rss_delta / 2**20:.0f} MiB"
+        )
+
+    def load_all(self, names=None):
+        """Load `names` (default: every enabled model) now.
+
+        Models are loaded one after another so each RSS delta belongs to one model.
+        """
+        for name in self._entries if names is None else names:
+            if self._entries[name].enabled:
+                try:
+                    self.get(name)
+                except Exception:
+                    pass
+
+    def ready(self, names=None) -> bool:
+        """Whether `names` (default: every enabled model) are loaded."""
+        entries = self._entries.values() if names is None else map(self._entries.get, names)
+        return all(e.state == "ready" for e in entries if e.enabled)
+
+    def status(self, names=None) -> dict:
+        return {
+            "ready": self.ready(names),
+            "rss_mb": round(rss_bytes() / 2**20, 1),
+            "models": {
+                name: {
+                    "state": e.state,
+                    "load_s": None if e.load_s is None else round(e.load_s, 3),
+                    "warmup_s": None if e.warmup_s is None else round(e.warmup_s, 3),
+                    "rss_delta_mb": None if e.rss_delta is None else round(e.rss_delta / 2**20, 1),
+                    "error": e.error,
+                }
+                for name, e in self._entries.items()
+            },
+        }
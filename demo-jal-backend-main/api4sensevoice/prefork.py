@@ -0,0 +1,86 @@
+import gc
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+from loguru import logger
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def run_prefork(app, host: str, port: int, workers: int, on_worker_start=None, **uvicorn_kwargs):
+    """Serve `app` from `workers` forked processes that share one listening socket.
+
+    Everything the parent loaded before calling this (the models) is shared
+    copy-on-write with the workers; `gc.freeze()` keeps the collector from
+    touching, and so copying, those objects. The kernel hands each new
+    connection to whichever worker accepts it first. `on_worker_start(index)`
+    runs in each worker right after the fork, before uvicorn starts. Workers
+    that exit unexpectedly are forked again; SIGINT / SIGTERM stop all of them.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                if on_worker_start is not None:
+                    on_worker_start(index)
+                uvicorn.Server(uvicorn.Config(app, **uvicorn_kwargs)).run(sockets=[sock])
+            except Exception as e:
+                logger.error(f"[prefork] worker {index} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+        logger.info(f"[prefork] worker {index} started; pid: {pid}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logger.info(f"[prefork] listening on {host}:{port} with {workers} workers")
+    for index in range(workers):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.warning(
+            f"[prefork] worker {index} (pid {pid}) exited with status {status}; restarting"
+        )
+        time.sleep(1)
+        spawn(index)
+    sock.close()
@@ -0,0 +1,173 @@
+import time
+
+import numpy as np
+
+
+class AudioRingBuffer:
+    """Fixed-capacity float32 sample buffer for streaming PCM ingestion.
+
+    Samples are addressed by their absolute index in the stream, so callers can
+    keep VAD timestamps as-is instead of rebasing them after every trim. Storage
+    is a single array of at least twice the live samples; live data is
+    compacted to the front only when the write position reaches the end, which
+    keeps every read a contiguous, zero-copy view and makes trimming amortized
+    O(1) per sample. Once more than ``capacity`` samples are live the oldest ones
+    are dropped.
+
+    Storage starts at ``2 * initial`` samples and doubles as needed up to
+    ``2 * capacity``; `reset` shrinks it back, so a buffer kept for reuse does
+    not hold on to the memory of its longest stream.
+    """
+
+    def __init__(self, capacity: int, initial: int = 1 << 16):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._initial = min(capacity, initial)
+        self._data = np.zeros(2 * self._initial, dtype=np.float32)
+        self._head = 0  # storage index of the oldest live sample
+        self._tail = 0  # storage index one past the newest sample
+        self._start = 0  # absolute index of the oldest live sample
+        self._cursor = 0  # absolute index of the next sample handed out by `next_chunk`
+        self._carry = b""  # trailing odd byte of the last PCM packet
+        self.dropped = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    @property
+    def start(self) -> int:
+        return self._start
+
+    @property
+    def end(self) -> int:
+        return self._start + len(self)
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+    def _reserve(self, n: int):
+        """Make room for `n` more samples, dropping the oldest ones if needed."""
+        overflow = len(self) + n - self.capacity
+        if overflow > 0:
+            self.discard_before(self._start + overflow)
+            self.dropped += overflow
+        if self._tail + n > len(self._data):
+            live = len(self)
+            if 2 * (live + n) > len(self._data) and len(self._data) < 2 * self.capacity:
+                size = min(2 * self.capacity, max(2 * len(self._data), 2 * (live + n)))
+                data = np.empty(size, dtype=np.float32)
+                data[:live] = self._data[self._head : self._tail]
+                self._data = data
+            else:
+                self._data[:live] = self._data[self._head : self._tail]
+            self._head, self._tail = 0, live
+
+    def extend(self, samples: np.ndarray):
+        """Append float32 samples."""
+        samples = samples[-self.capacity :]
+        n = len(samples)
+        self._reserve(n)
+        self._data[self._tail : self._tail + n] = samples
+        self._tail += n
+
+    def extend_pcm16(self, data: bytes) -> int:
+        """Append little-endian int16 PCM, converting to float32 in place.
+
+        An odd trailing byte is carried over to the next call. Returns the number
+        of samples appended.
+        """
+        if self._carry:
+            data = self._carry + data
+        usable = len(data) - (len(data) % 2)
+        self._carry = data[usable:]
+        if usable == 0:
+            return 0
+        pcm = np.frombuffer(data, dtype=np.int16, count=usable // 2)[-self.capacity :]
+        n = len(pcm)
+        self._reserve(n)
+        np.divide(
+            pcm, 32767.0, out=self._data[self._tail : self._tail + n], dtype=np.float32
+        )
+        self._tail += n
+        return n
+
+    def view(self, beg: int, end: int = None) -> np.ndarray:
+        """Return a view of absolute samples [beg, end), clipped to what is retained."""
+        if end is None:
+            end = self.end
+        beg = min(max(beg, self._start), self.end)
+        end = min(max(end, beg), self.end)
+        offset = self._head - self._start
+        return self._data[beg + offset : end + offset]
+
+    def next_chunk(self, size: int):
+        """Return the next unread `size` samples as a view, or None if not buffered yet."""
+        self._cursor = max(self._cursor, self._start)
+        if self.end - self._cursor < size:
+            return None
+        chunk = self.view(self._cursor, self._cursor + size)
+        self._cursor += size
+        return chunk
+
+    def discard_before(self, pos: int):
+        """Release all samples before absolute index `pos`."""
+        pos = min(max(pos, self._start), self.end)
+        self._head += pos - self._start
+        self._start = pos
+
+    def reset(self):
+        if len(self._data) > 2 * self._initial:
+            self._data = np.zeros(2 * self._initial, dtype=np.float32)
+        self._head = self._tail = 0
+        self._start = self._cursor = 0
+        self._carry = b""
+        self.dropped = 0
+
+
+if __name__ == "__main__":
+    # Micro-benchmark: per-chunk ingestion cost on a continuous stream with no VAD end,
+    # i.e. the worst case for the previous `np.append` based handler.
+    sample_rate = 16000
+    packet = (np.random.randn(1600) * 3000).astype(np.int16).tobytes()  # 100 ms packets
+    chunk_size = int(300 * sample_rate / 1000)
+    minutes = 12
+    packets = minutes * 60 * 10
+    report_every = 60 * 10
+
+    def bench_np_append():
+        audio_buffer = np.array([], dtype=np.float32)
+        audio_vad = np.array([], dtype=np.float32)
+        timings = []
+        t0 = time.perf_counter()
+        for i in range(packets):
+            audio_buffer = np.append(
+                audio_buffer, np.frombuffer(packet, dtype=np.int16).astype(np.float32) / 32767.0
+            )
+            while len(audio_buffer) >= chunk_size:
+                chunk = audio_buffer[:chunk_size]
+                audio_buffer = audio_buffer[chunk_size:]
+                audio_vad = np.append(audio_vad, chunk)
+            if (i + 1) % report_every == 0:
+                timings.append((time.perf_counter() - t0) / report_every)
+                t0 = time.perf_counter()
+        return timings
+
+    def bench_ring():
+        ring = AudioRingBuffer(capacity=90 * sample_rate)
+        timings = []
+        t0 = time.perf_counter()
+        for i in range(packets):
+            ring.extend_pcm16(packet)
+            while ring.next_chunk(chunk_size) is not None:
+                pass
+            if (i + 1) % report_every == 0:
+                timings.append((time.perf_counter() - t0) / report_every)
+                t0 = time.perf_counter()
+        return timings
+
+    for name, bench in (("np.append", bench_np_append), ("ring", bench_ring)):
+        timings = bench()
+        per_minute = " ".join(f"{t * 1e6:7.1f}" for t in timings)
+        print(f"{name:>10} us/packet by stream minute: {per_minute}")
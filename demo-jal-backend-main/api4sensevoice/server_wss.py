@@ -1,4 +1,4 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException, UploadFile, File, Form
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,19 +7,31 @@ from pydantic_settings import BaseSettings
 from pydantic import BaseModel, Field
 from funasr import AutoModel
 import numpy as np
-import soundfile as sf
 import argparse
 import uvicorn
 from urllib.parse import parse_qs
 import os
 import re
-from modelscope.pipelines import pipeline
-from modelscope.utils.constant import Tasks
 from loguru import logger
 import sys
 import json
 import traceback
 import time
+import torch
+from session import SessionPool, SessionLimitError, StreamSession
+from inference_scheduler import InferenceScheduler
+from inference_executor import BacklogFullError, ChunkQueue, InferenceExecutor
+from cpu_backend import build_logits_fn, set_cpu_threads
+from text_format import format_str_v4
+from speaker import SpeakerStore, SegmentEmbedding
+from model_registry import ModelDisabledError, ModelRegistry
+from contextlib import asynccontextmanager
+from prefork import available_cpus, run_prefork
+from audio_decoder import CODECS, StreamDecoder, decode_audio
+from batch_transcribe import BatchJobs, transcribe_audio
+from bucketing import LengthBucketer, PaddingStats
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 
 logger.remove()
 log_format = "{time:YYYY-MM-DD HH:mm:ss} [{level}] {file}:{line} - {message}"
@@ -39,230 +51,356 @@ logger.add(
 
 class Config(BaseSettings):
     sv_thr: float = Field(0.3, description="Speaker verification threshold")
+    sv_cache_path: str = Field(
+        "speaker/embeddings.npz", description="On-disk cache of enrollment embeddings"
+    )
+    sv_incremental: bool = Field(
+        False,
+        description=(
+            "Embed each window of a segment once instead of re-embedding it; scores a mean of "
+            "window embeddings, so check sv_thr against it (python speaker.py) before enabling"
+        ),
+    )
+    sv_window_ms: int = Field(
+        1000, description="Window of incremental speaker verification; re-scored once per window"
+    )
     chunk_size_ms: int = Field(300, description="Chunk size in milliseconds")
     sample_rate: int = Field(16000, description="Sample rate in Hz")
     bit_depth: int = Field(16, description="Bit depth")
     channels: int = Field(1, description="Number of audio channels")
     avg_logprob_thr: float = Field(-0.25, description="average logprob threshold")
+    max_buffer_s: float = Field(
+        90.0, description="Seconds of audio retained per connection for VAD segments"
+    )
+    device: str = Field(
+        "cuda:0" if torch.cuda.is_available() else "cpu",
+        description="Device for the ASR model",
+    )
+    asr_max_batch_size: int = Field(
+        8, description="Maximum number of segments per ASR forward pass"
+    )
+    asr_max_wait_ms: float = Field(
+        20.0, description="Maximum time a segment waits for batch-mates"
+    )
+    executor_kind: str = Field(
+        "thread", description="Pool for ASR/speaker-verify calls: thread or process"
+    )
+    executor_workers: int = Field(4, description="Workers for ASR/speaker-verify calls")
+    vad_workers: int = Field(4, description="Threads for streaming VAD calls")
+    max_pending_chunks: int = Field(
+        32, description="Received packets buffered per connection before backpressure"
+    )
+    backpressure_policy: str = Field(
+        "merge", description="What to do with excess packets: merge or drop"
+    )
+    max_pending_s: float = Field(
+        30.0,
+        description=(
+            "Seconds of received audio buffered per connection; past it merge closes the "
+            "connection and drop discards the oldest packets"
+        ),
+    )
+    max_sessions: int = Field(
+        0, description="Maximum concurrent connections, 0 for unlimited"
+    )
+    max_idle_sessions: int = Field(
+        64, description="Released sessions kept for reuse by new connections"
+    )
+    partial_results: bool = Field(
+        False, description="Send partial transcripts (code=1) for every chunk by default"
+    )
+    asr_backend: str = Field(
+        "torch",
+        description=(
+            "Final-transcript backend: torch, torch_int8, torch_bf16, torch_compile, onnx or "
+            "onnx_int8 (CPU only)"
+        ),
+    )
+    compile_buckets_s: str = Field(
+        "2,5,10,20,30",
+        description="Padded lengths (seconds) torch_compile builds a graph for; longer runs eagerly",
+    )
+    onnx_dir: str = Field(
+        "", description="Where exported ONNX models are kept, default <model dir>/onnx"
+    )
+    sdpa_attention: bool = Field(
+        True, description="Use fused scaled_dot_product_attention in the ASR encoder"
+    )
+    intra_op_threads: int = Field(0, description="CPU threads per operator, 0 for default")
+    inter_op_threads: int = Field(0, description="CPU threads across operators, 0 for default")
+    enable_sv: bool = Field(True, description="Allow speaker verification (sv=true)")
+    enable_asr_pipeline: bool = Field(
+        False, description="Also build the modelscope ASR pipeline (unused by the handlers)"
+    )
+    batch_workers: int = Field(1, description="Threads running uploaded-file transcriptions")
+    batch_size_s: float = Field(
+        300, description="Seconds of padded audio per batch of an uploaded-file transcription"
+    )
+    batch_max_batch_size: int = Field(64, description="Maximum segments per batch of a file")
+    batch_max_jobs: int = Field(100, description="Finished batch jobs kept for polling")
+    length_buckets_s: str = Field(
+        "1,2,4,8,16,32",
+        description="Segment length buckets (upper edges, seconds) of batched ASR; empty to only sort",
+    )
+    preload_models: str = Field(
+        "asr,asr_backend,vad",
+        description="Models loaded at startup (comma separated); the rest load on first use",
+    )
+    model_retry_s: float = Field(
+        60.0, description="Seconds a failed model load is reported as failed before it is retried"
+    )
 
 
 config = Config()
 
-emo_dict = {
-    "<|HAPPY|>": "😊",
-    "<|SAD|>": "😔",
-    "<|ANGRY|>": "😡",
-    "<|NEUTRAL|>": "",
-    "<|FEARFUL|>": "😰",
-    "<|DISGUSTED|>": "🤢",
-    "<|SURPRISED|>": "😮",
-}
-
-event_dict = {
-    "<|BGM|>": "🎼",
-    "<|Speech|>": "",
-    "<|Applause|>": "👏",
-    "<|Laughter|>": "😀",
-    "<|Cry|>": "😭",
-    "<|Sneeze|>": "🤧",
-    "<|Breath|>": "",
-    "<|Cough|>": "🤧",
-}
-
-emoji_dict = {
-    "<|nospeech|><|Event_UNK|>": "❓",
-    "<|zh|>": "",
-    "<|en|>": "",
-    "<|yue|>": "",
-    "<|ja|>": "",
-    "<|ko|>": "",
-    "<|nospeech|>": "",
-    "<|HAPPY|>": "😊",
-    "<|SAD|>": "😔",
-    "<|ANGRY|>": "😡",
-    "<|NEUTRAL|>": "",
-    "<|BGM|>": "🎼",
-    "<|Speech|>": "",
-    "<|Applause|>": "👏",
-    "<|Laughter|>": "😀",
-    "<|FEARFUL|>": "😰",
-    "<|DISGUSTED|>": "🤢",
-    "<|SURPRISED|>": "😮",
-    "<|Cry|>": "😭",
-    "<|EMO_UNKNOWN|>": "",
-    "<|Sneeze|>": "🤧",
-    "<|Breath|>": "",
-    "<|Cough|>": "😷",
-    "<|Sing|>": "",
-    "<|Speech_Noise|>": "",
-    "<|withitn|>": "",
-    "<|woitn|>": "",
-    "<|GBG|>": "",
-    "<|Event_UNK|>": "",
-}
-
-lang_dict = {
-    "<|zh|>": "<|lang|>",
-    "<|en|>": "<|lang|>",
-    "<|yue|>": "<|lang|>",
-    "<|ja|>": "<|lang|>",
-    "<|ko|>": "<|lang|>",
-    "<|nospeech|>": "<|lang|>",
-}
-
-emo_set = {"😊", "😔", "😡", "😰", "🤢", "😮"}
-event_set = {
-    "🎼",
-    "👏",
-    "😀",
-    "😭",
-    "🤧",
-    "😷",
-}
-
-
-def format_str(s):
-    for sptk in emoji_dict:
-        s = s.replace(sptk, emoji_dict[sptk])
-    return s
-
-
-def format_str_v2(s):
-    sptk_dict = {}
-    for sptk in emoji_dict:
-        sptk_dict[sptk] = s.count(sptk)
-        s = s.replace(sptk, "")
-    emo = "<|NEUTRAL|>"
-    for e in emo_dict:
-        if sptk_dict[e] > sptk_dict[emo]:
-            emo = e
-    for e in event_dict:
-        if sptk_dict[e] > 0:
-            s = event_dict[e] + s
-    s = s + emo_dict[emo]
-
-    for emoji in emo_set.union(event_set):
-        s = s.replace(" " + emoji, emoji)
-        s = s.replace(emoji + " ", emoji)
-    return s.strip()
-
-
-def format_str_v3(s):
-    def get_emo(s):
-        return s[-1] if s[-1] in emo_set else None
-
-    def get_event(s):
-        return s[0] if s[0] in event_set else None
-
-    s = s.replace("<|nospeech|><|Event_UNK|>", "❓")
-    for lang in lang_dict:
-        s = s.replace(lang, "<|lang|>")
-    s_list = [format_str_v2(s_i).strip(" ") for s_i in s.split("<|lang|>")]
-    new_s = " " + s_list[0]
-    cur_ent_event = get_event(new_s)
-    for i in range(1, len(s_list)):
-        if len(s_list[i]) == 0:
-            continue
-        if get_event(s_list[i]) == cur_ent_event and get_event(s_list[i]) != None:
-            s_list[i] = s_list[i][1:]
-        # else:
-        cur_ent_event = get_event(s_list[i])
-        if get_emo(s_list[i]) != None and get_emo(s_list[i]) == get_emo(new_s):
-            new_s = new_s[:-1]
-        new_s += s_list[i].strip().lstrip()
-    new_s = new_s.replace("The.", " ")
-    return new_s.strip()
-
 
 def contains_chinese_english_number(s: str) -> bool:
     # Check if the string contains any Chinese character, English letter, or Arabic number
     return bool(re.search(r"[\u4e00-\u9fffA-Za-z0-9]", s))
 
 
-sv_pipeline = pipeline(
-    task="speaker-verification",
-    model="iic/speech_eres2net_large_sv_zh-cn_3dspeaker_16k",
-    model_revision="v1.0.0",
-)
+def load_sv():
+    from modelscope.pipelines import pipeline
 
-asr_pipeline = pipeline(
-    task=Tasks.auto_speech_recognition,
-    model="iic/SenseVoiceSmall",
-    model_revision="master",
-    device="cuda:0",
-    disable_update=True,
-)
+    return pipeline(
+        task="speaker-verification",
+        model="iic/speech_eres2net_large_sv_zh-cn_3dspeaker_16k",
+        model_revision="v1.0.0",
+    )
 
-model_asr = AutoModel(
-    model="iic/SenseVoiceSmall",
-    trust_remote_code=True,
-    remote_code="./model.py",
-    device="cuda:0",
-    disable_update=True,
-)
 
-model_vad = AutoModel(
-    model="fsmn-vad",
-    model_revision="v2.0.4",
-    disable_pbar=True,
-    max_end_silence_time=500,
-    # speech_noise_thres=0.6,
-    disable_update=True,
-)
+def load_asr_pipeline():
+    from modelscope.pipelines import pipeline
+    from modelscope.utils.constant import Tasks
 
-# 注释掉说话人验证文件初始化，因为用户不需要此功能
-reg_spks_files = []
-# reg_spks_files = ["api4sensevoice/speaker/speaker1_a_cn_16k.wav"]
+    return pipeline(
+        task=Tasks.auto_speech_recognition,
+        model="iic/SenseVoiceSmall",
+        model_revision="master",
+        device=config.device,
+        disable_update=True,
+    )
 
 
-def reg_spk_init(files):
-    reg_spk = {}
-    for f in files:
-        data, sr = sf.read(f, dtype="float32")
-        k, _ = os.path.splitext(os.path.basename(f))
-        reg_spk[k] = {
-            "data": data,
-            "sr": sr,
-        }
-    return reg_spk
+def load_asr():
+    model_asr = AutoModel(
+        model="iic/SenseVoiceSmall",
+        trust_remote_code=True,
+        remote_code="./model.py",
+        device=config.device,
+        disable_update=True,
+    )
+    model_asr.model.set_sdpa(config.sdpa_attention)
+    return model_asr
+
+
+def load_asr_backend():
+    model_asr = models.get("asr")
+    return build_logits_fn(
+        model_asr.model,
+        config.asr_backend,
+        config.onnx_dir or os.path.join(model_asr.kwargs.get("model_path", "."), "onnx"),
+        config.intra_op_threads,
+        config.inter_op_threads,
+        compile_buckets_s=[float(b) for b in config.compile_buckets_s.split(",") if b.strip()],
+    )
 
 
-# 由于不需要说话人验证，初始化为空列表
-reg_spks = {}
-# reg_spks = reg_spk_init(reg_spks_files)
+def load_vad():
+    return AutoModel(
+        model="fsmn-vad",
+        model_revision="v2.0.4",
+        disable_pbar=True,
+        max_end_silence_time=500,
+        # speech_noise_thres=0.6,
+        disable_update=True,
+    )
 
 
-def speaker_verify(audio, sv_thr):
-    hit = False
-    for k, v in reg_spks.items():
-        res_sv = sv_pipeline([audio, v["data"]], sv_thr)
-        if res_sv["score"] >= sv_thr:
-            hit = True
-        logger.info(
-            f"[speaker_verify] audio_len: {len(audio)}; sv_thr: {sv_thr}; hit: {hit}; {k}: {res_sv}"
+def warmup_sv(sv_pipeline):
+    with torch.no_grad():
+        sv_pipeline.forward(sv_pipeline.preprocess([np.zeros(config.sample_rate, dtype=np.float32)]))
+
+
+def warmup_asr(model_asr, logits_fn=None):
+    with torch.inference_mode():
+        model_asr.model.transcribe_pcm(
+            [np.zeros(config.sample_rate, dtype=np.float32)],
+            tokenizer=model_asr.kwargs["tokenizer"],
+            frontend=model_asr.kwargs["frontend"],
+            device=config.device,
+            logits_fn=logits_fn,
         )
+
+
+def warmup_asr_backend(logits_fn):
+    if hasattr(logits_fn, "warmup"):
+        # Compile every length bucket now instead of on the first requests.
+        logits_fn.warmup(max(config.asr_max_batch_size, config.batch_max_batch_size))
+    if logits_fn is not None:
+        warmup_asr(models.get("asr"), logits_fn)
+
+
+def warmup_vad(model_vad):
+    model_vad.inference(
+        np.zeros(int(config.chunk_size_ms * config.sample_rate / 1000), dtype=np.float32),
+        kwargs=dict(model_vad.kwargs),
+        cache={},
+        is_final=False,
+        chunk_size=config.chunk_size_ms,
+    )
+
+
+set_cpu_threads(config.intra_op_threads, config.inter_op_threads)
+models = ModelRegistry(retry_s=config.model_retry_s)
+models.register("sv", load_sv, warmup_sv, enabled=config.enable_sv)
+models.register("asr_pipeline", load_asr_pipeline, enabled=config.enable_asr_pipeline)
+models.register("asr", load_asr, warmup_asr)
+models.register("asr_backend", load_asr_backend, warmup_asr_backend)
+models.register("vad", load_vad, warmup_vad)
+preload_models = [name.strip() for name in config.preload_models.split(",") if name.strip()]
+models.check(preload_models)
+
+
+def sv_embed(audios):
+    """Speaker embeddings (N, dim) of float32 waveforms.
+
+    Calls the pipeline's preprocess/forward directly: `sv_pipeline(...,
+    output_emb=True)` returns a dict shared between calls, which is not safe
+    from several executor threads.
+    """
+    sv_pipeline = models.get("sv")
+    with torch.no_grad():
+        return sv_pipeline.forward(sv_pipeline.preprocess(list(audios))).cpu().numpy()
+
+
+# 由于不需要说话人验证，不注册任何说话人；需要时调用 reg_spks.enroll_files(...)
+reg_spks = SpeakerStore(sv_embed, config.sv_cache_path)
+
+
+def speaker_verify(audio, sv_thr):
+    started = time.perf_counter()
+    hit, k, score = reg_spks.verify(audio, sv_thr)
+    logger.info(
+        f"[speaker_verify] audio_len: {len(audio)}; sv_thr: {sv_thr}; hit: {hit}; {k}: {score}; "
+        f"speakers: {len(reg_spks)}; elapsed: {(time.perf_counter() - started) * 1000:.2f} ms"
+    )
+    return hit, k
+
+
+def speaker_verify_incremental(state: SegmentEmbedding, segment, sv_thr, final=False):
+    """Like `speaker_verify`, but only embeds the windows `state` has not seen yet."""
+    started = time.perf_counter()
+    result = reg_spks.verify_incremental(
+        state, segment, int(config.sv_window_ms * config.sample_rate / 1000), sv_thr, final
+    )
+    if result is None:
+        return False, None
+    hit, k, score = result
+    logger.info(
+        f"[speaker_verify] audio_len: {len(segment)}; windows: {state.count:g}; sv_thr: {sv_thr}; "
+        f"hit: {hit}; {k}: {score}; elapsed: {(time.perf_counter() - started) * 1000:.2f} ms"
+    )
     return hit, k
 
 
-def asr(audio, lang, cache, use_itn=False):
-    # with open('test.pcm', 'ab') as f:
-    #     logger.debug(f'write {f.write(audio)} bytes to `test.pcm`')
-    # result = asr_pipeline(audio, lang)
-    start_time = time.time()
-    result = model_asr.generate(
-        input=audio,
+def vad_chunk(chunk, cache):
+    """Feed one chunk to the streaming VAD.
+
+    `AutoModel.generate` merges per-call options such as `cache` into the
+    model's shared kwargs, so concurrent calls from several threads could pick up
+    each other's cache. Each call gets its own copy instead.
+    """
+    model_vad = models.get("vad")
+    return model_vad.inference(
+        chunk,
+        kwargs=dict(model_vad.kwargs),
         cache=cache,
-        language=lang.strip(),
-        use_itn=use_itn,
-        batch_size_s=60,
+        is_final=False,
+        chunk_size=config.chunk_size_ms,
+    )
+
+
+def asr_batch(audios, lang, use_itn=False):
+    """Transcribe several segments with one batched PCM -> fbank -> encoder pass."""
+    model_asr = models.get("asr")
+    with torch.inference_mode():
+        results, meta_data = model_asr.model.transcribe_pcm(
+            audios,
+            tokenizer=model_asr.kwargs["tokenizer"],
+            frontend=model_asr.kwargs["frontend"],
+            device=config.device,
+            language=lang.strip(),
+            use_itn=use_itn,
+            logits_fn=models.get("asr_backend"),
+        )
+    logger.debug(f"asr batch of {len(audios)}: {meta_data}")
+    return results
+
+
+def asr_partial(audio, cache, lang, use_itn=False):
+    """Extend the partial transcript of the current segment by the newest audio."""
+    model_asr = models.get("asr")
+    with torch.inference_mode():
+        return model_asr.model.inference_chunk(
+            audio,
+            cache,
+            tokenizer=model_asr.kwargs["tokenizer"],
+            frontend=model_asr.kwargs["frontend"],
+            device=config.device,
+            language=lang.strip(),
+            use_itn=use_itn,
+        )
+
+
+executor = InferenceExecutor(
+    kind=config.executor_kind,
+    max_workers=config.executor_workers,
+    stream_workers=config.vad_workers,
+)
+
+session_pool = SessionPool(
+    int(config.max_buffer_s * config.sample_rate),
+    max_sessions=config.max_sessions,
+    max_idle=config.max_idle_sessions,
+)
+
+length_bucketer = LengthBucketer(
+    [float(b) for b in config.length_buckets_s.split(",") if b.strip()], config.sample_rate
+)
+batch_padding = PaddingStats()
+batch_pool = ThreadPoolExecutor(config.batch_workers, thread_name_prefix="batch")
+batch_jobs = BatchJobs(max_finished=config.batch_max_jobs)
+
+asr_scheduler = InferenceScheduler(
+    asr_batch,
+    max_batch_size=config.asr_max_batch_size,
+    max_wait_ms=config.asr_max_wait_ms,
+    executor=executor.model_pool,
+    bucketer=length_bucketer,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    preload = asyncio.get_running_loop().run_in_executor(
+        None, models.load_all, preload_models
+    )
+    preload.add_done_callback(
+        lambda _: logger.info(
+            f"[models] preload done in {time.perf_counter() - started:.2f}s: {models.status()}"
+        )
     )
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    logger.debug(f"asr elapsed: {elapsed_time * 1000:.2f} milliseconds")
-    return result
+    if config.executor_kind == "process":
+        # Forked workers only share models that exist before they start.
+        await preload
+    yield
+    executor.shutdown()
+    batch_pool.shutdown(wait=False, cancel_futures=True)
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -304,8 +442,222 @@ class TranscriptionResponse(BaseModel):
     data: str
 
 
+@app.get("/ready")
+async def ready():
+    """200 once the preloaded models are ready, 503 before; load time and RSS per model."""
+    status = models.status(preload_models)
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.post("/models/{name}/reload")
+async def reload_model(name: str):
+    """Load a model again now, e.g. after fixing what made it fail."""
+    try:
+        models.check([name])
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Unknown model")
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, models.reload, name)
+    except ModelDisabledError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return models.status([name])["models"][name]
+
+
+@app.get("/stats/scheduler")
+async def scheduler_stats():
+    return asr_scheduler.stats()
+
+
+@app.get("/stats/sessions")
+async def session_stats():
+    return session_pool.stats()
+
+
+def transcribe_file(data: bytes, lang: str, use_itn: bool, progress=None):
+    """Decode an uploaded recording and transcribe it in length-sorted batches."""
+    audio = decode_audio(data, config.sample_rate)
+    return transcribe_audio(
+        models.get("asr"),
+        models.get("vad"),
+        audio,
+        sample_rate=config.sample_rate,
+        language=lang.strip(),
+        use_itn=use_itn,
+        batch_size_s=config.batch_size_s,
+        max_batch_size=config.batch_max_batch_size,
+        bucketer=length_bucketer,
+        padding_stats=batch_padding,
+        progress=progress,
+        device=config.device,
+        logits_fn=models.get("asr_backend"),
+    )
+
+
+@app.post("/batch/transcribe")
+async def batch_transcribe(
+    file: UploadFile = File(...),
+    lang: str = Form("auto"),
+    use_itn: bool = Form(True),
+    wait: bool = Form(False),
+):
+    """Transcribe a whole recording (any format ffmpeg reads).
+
+    Returns the job right away; poll GET /batch/jobs/{id} for progress and the
+    transcript, or pass wait=true to get the finished job in this response.
+    """
+    data = await file.read()
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty file")
+    job_id = batch_jobs.create(file.filename or "")
+    running = asyncio.get_running_loop().run_in_executor(
+        batch_pool, batch_jobs.run, job_id, transcribe_file, data, lang, use_itn
+    )
+    if not wait:
+        return batch_jobs.get(job_id)
+    await running
+    job = batch_jobs.get(job_id)
+    return JSONResponse(status_code=200 if job["state"] == "done" else 500, content=job)
+
+
+@app.get("/stats/batch")
+async def batch_stats():
+    return {"padding": batch_padding.snapshot()}
+
+
+@app.get("/batch/jobs/{job_id}")
+async def batch_job(job_id: str):
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+
+async def verify_speaker(websocket: WebSocket, session: StreamSession, segment, final=False):
+    """Score the current segment against the enrolled speakers until one is hit.
+
+    `final` marks the complete segment after VAD has closed it, so the audio
+    since the last (incremental) check is scored too.
+    """
+    if config.sv_incremental:
+        session.hit, speaker = await executor.run_stateful(
+            speaker_verify_incremental, session.sv_state, segment, config.sv_thr, final
+        )
+    else:
+        session.hit, speaker = await executor.run(speaker_verify, segment, config.sv_thr)
+    if session.hit:
+        response = TranscriptionResponse(code=2, info="detect speaker", data=speaker)
+        await websocket.send_json(response.model_dump())
+
+
+async def transcribe_stream(websocket: WebSocket, pending: ChunkQueue, session: StreamSession):
+    """Run VAD/ASR over the packets queued by the connection's receive loop."""
+    chunk_size = int(config.chunk_size_ms * config.sample_rate / 1000)
+    # Samples are indexed from the start of the stream, so VAD timestamps
+    # (absolute milliseconds) map directly onto buffer positions.
+    audio = session.audio
+
+    while True:
+        audio.extend_pcm16(await pending.get())
+
+        while (chunk := audio.next_chunk(chunk_size)) is not None:
+            session.chunks += 1
+            if session.last_vad_beg > 1:
+                if session.sv:
+                    # speaker verify
+                    # If no hit is detected, continue accumulating audio data and check again until a hit is detected
+                    # `hit` will reset after `asr`.
+                    if not session.hit:
+                        await verify_speaker(
+                            websocket,
+                            session,
+                            audio.view(int(session.last_vad_beg * config.sample_rate / 1000)),
+                        )
+                else:
+                    response = TranscriptionResponse(
+                        code=2, info="detect speech", data=""
+                    )
+                    await websocket.send_json(response.model_dump())
+
+            res = await executor.run_stateful(vad_chunk, chunk, session.vad_cache)
+            # logger.info(f"vad inference: {res}")
+            if len(res[0]["value"]):
+                vad_segments = res[0]["value"]
+                for segment in vad_segments:
+                    if segment[0] > -1:  # speech begin
+                        session.last_vad_beg = segment[0]
+                    if segment[1] > -1:  # speech end
+                        session.last_vad_end = segment[1]
+                    if session.last_vad_beg > -1 and session.last_vad_end > -1:
+                        beg = int(session.last_vad_beg * config.sample_rate / 1000)
+                        end = int(session.last_vad_end * config.sample_rate / 1000)
+                        logger.info(f"[vad segment] audio_len: {end - beg}")
+                        if session.sv and not session.hit:
+                            # Audio since the last check (all of it for a segment
+                            # that ended within one chunk) has not been scored yet.
+                            await verify_speaker(websocket, session, audio.view(beg, end), True)
+                        result = (
+                            None
+                            if session.sv and not session.hit
+                            else [
+                                await asr_scheduler.submit(
+                                    audio.view(beg, end), session.lang, True
+                                )
+                            ]
+                        )
+                        logger.info(f"asr response: {result}")
+                        audio.discard_before(end)
+                        session.end_segment()
+
+                        if result is not None:
+                            response = TranscriptionResponse(
+                                code=0,
+                                info=json.dumps(result[0], ensure_ascii=False),
+                                data=format_str_v4(result[0]["text"]),
+                            )
+                            await websocket.send_json(response.model_dump())
+
+                    # logger.debug(f'last_vad_beg: {session.last_vad_beg}; last_vad_end: {session.last_vad_end} len(audio): {len(audio)}')
+
+            if (
+                session.partial
+                and session.last_vad_beg > -1
+                and not (session.sv and not session.hit)
+            ):
+                # Only the audio added since the previous chunk is encoded.
+                partial = await executor.run_stateful(
+                    asr_partial,
+                    audio.view(int(session.last_vad_beg * config.sample_rate / 1000)),
+                    session.asr_cache,
+                    session.lang,
+                    True,
+                )
+                if partial["text"] and partial["text"] != session.asr_cache.get("sent"):
+                    session.asr_cache["sent"] = partial["text"]
+                    response = TranscriptionResponse(
+                        code=1,
+                        info=json.dumps(partial, ensure_ascii=False),
+                        data=format_str_v4(partial["text"]),
+                    )
+                    await websocket.send_json(response.model_dump())
+
+
+async def pump_decoded(decoder: StreamDecoder, pending: ChunkQueue):
+    """Move decoded PCM from `decoder` to the connection's queue."""
+    while data := await decoder.read():
+        pending.put_pcm16(data)
+
+
 @app.websocket("/ws/transcribe")
 async def websocket_endpoint(websocket: WebSocket):
+    session = None
+    processor = None
+    decoder = None
+    pump = None
+    pending = ChunkQueue(
+        config.max_pending_chunks,
+        config.backpressure_policy,
+        max_bytes=int(config.max_pending_s * config.sample_rate) * 2,
+    )
     try:
         query_params = parse_qs(websocket.scope["query_string"].decode())
         sv = query_params.get("sv", ["false"])[0].lower() in [
@@ -316,127 +668,81 @@ async def websocket_endpoint(websocket: WebSocket):
             "yes",
         ]
         lang = query_params.get("lang", ["auto"])[0].lower()
+        partial = query_params.get("partial", [str(config.partial_results)])[0].lower() in [
+            "true",
+            "1",
+            "t",
+            "y",
+            "yes",
+        ]
 
-        await websocket.accept()
-        chunk_size = int(config.chunk_size_ms * config.sample_rate / 1000)
-        audio_buffer = np.array([], dtype=np.float32)
-        audio_vad = np.array([], dtype=np.float32)
+        if sv and not models.enabled("sv"):
+            logger.warning("Speaker verification is disabled; ignoring sv=true")
+            sv = False
+
+        codec = query_params.get("codec", ["pcm"])[0].lower()
+        sample_rate = int(query_params.get("sample_rate", [str(config.sample_rate)])[0])
+        if codec not in CODECS or sample_rate <= 0:
+            logger.warning(f"Rejecting connection: codec {codec} at {sample_rate} Hz")
+            await websocket.close(code=1003)
+            return
+
+        try:
+            session = session_pool.acquire(sv=sv, lang=lang.strip(), partial=partial)
+        except SessionLimitError as e:
+            logger.warning(f"Rejecting connection: {e}")
+            await websocket.close(code=1013)
+            return
+
+        if codec != "pcm" or sample_rate != config.sample_rate:
+            # Compressed or resampled input goes through ffmpeg; its output is
+            # 16 kHz int16 PCM like the plain protocol.
+            decoder = StreamDecoder(codec, sample_rate, config.sample_rate)
+            await decoder.start()
+            pump = asyncio.create_task(pump_decoded(decoder, pending))
 
-        cache = {}
-        cache_asr = {}
-        last_vad_beg = last_vad_end = -1
-        offset = 0
-        hit = False
+        await websocket.accept()
+        # Model calls happen in `processor`; this loop only receives, so a slow
+        # segment never delays reading from this or any other socket.
+        processor = asyncio.create_task(transcribe_stream(websocket, pending, session))
 
-        buffer = b""
         while True:
             data = await websocket.receive_bytes()
             # logger.info(f"received {len(data)} bytes")
+            if processor.done():
+                processor.result()  # re-raise the processing error
+                break
+            if pump is not None and pump.done():
+                pump.result()  # e.g. BacklogFullError from the decoded audio
 
-            buffer += data
-            if len(buffer) < 2:
-                continue
-
-            audio_buffer = np.append(
-                audio_buffer,
-                np.frombuffer(
-                    buffer[: len(buffer) - (len(buffer) % 2)], dtype=np.int16
-                ).astype(np.float32)
-                / 32767.0,
-            )
-
-            # with open('buffer.pcm', 'ab') as f:
-            #     logger.debug(f'write {f.write(buffer[:len(buffer) - (len(buffer) % 2)])} bytes to `buffer.pcm`')
-
-            buffer = buffer[len(buffer) - (len(buffer) % 2) :]
-
-            while len(audio_buffer) >= chunk_size:
-                chunk = audio_buffer[:chunk_size]
-                audio_buffer = audio_buffer[chunk_size:]
-                audio_vad = np.append(audio_vad, chunk)
-
-                # with open('chunk.pcm', 'ab') as f:
-                #     logger.debug(f'write {f.write(chunk)} bytes to `chunk.pcm`')
-
-                if last_vad_beg > 1:
-                    if sv:
-                        # speaker verify
-                        # If no hit is detected, continue accumulating audio data and check again until a hit is detected
-                        # `hit` will reset after `asr`.
-                        if not hit:
-                            hit, speaker = speaker_verify(
-                                audio_vad[
-                                    int(
-                                        (last_vad_beg - offset)
-                                        * config.sample_rate
-                                        / 1000
-                                    ) :
-                                ],
-                                config.sv_thr,
-                            )
-                            if hit:
-                                response = TranscriptionResponse(
-                                    code=2, info="detect speaker", data=speaker
-                                )
-                                await websocket.send_json(response.model_dump())
-                    else:
-                        response = TranscriptionResponse(
-                            code=2, info="detect speech", data=""
-                        )
-                        await websocket.send_json(response.model_dump())
-
-                res = model_vad.generate(
-                    input=chunk,
-                    cache=cache,
-                    is_final=False,
-                    chunk_size=config.chunk_size_ms,
-                )
-                # logger.info(f"vad inference: {res}")
-                if len(res[0]["value"]):
-                    vad_segments = res[0]["value"]
-                    for segment in vad_segments:
-                        if segment[0] > -1:  # speech begin
-                            last_vad_beg = segment[0]
-                        if segment[1] > -1:  # speech end
-                            last_vad_end = segment[1]
-                        if last_vad_beg > -1 and last_vad_end > -1:
-                            last_vad_beg -= offset
-                            last_vad_end -= offset
-                            offset += last_vad_end
-                            beg = int(last_vad_beg * config.sample_rate / 1000)
-                            end = int(last_vad_end * config.sample_rate / 1000)
-                            logger.info(f"[vad segment] audio_len: {end - beg}")
-                            result = (
-                                None
-                                if sv and not hit
-                                else asr(
-                                    audio_vad[beg:end], lang.strip(), cache_asr, True
-                                )
-                            )
-                            logger.info(f"asr response: {result}")
-                            audio_vad = audio_vad[end:]
-                            last_vad_beg = last_vad_end = -1
-                            hit = False
-
-                            if result is not None:
-                                response = TranscriptionResponse(
-                                    code=0,
-                                    info=json.dumps(result[0], ensure_ascii=False),
-                                    data=format_str_v3(result[0]["text"]),
-                                )
-                                await websocket.send_json(response.model_dump())
-
-                        # logger.debug(f'last_vad_beg: {last_vad_beg}; last_vad_end: {last_vad_end} len(audio_vad): {len(audio_vad)}')
+            if decoder is not None:
+                await decoder.feed(data)
+            else:
+                pending.put_pcm16(data)
 
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected")
+    except BacklogFullError as e:
+        logger.warning(f"Closing connection that falls behind: {e}")
+        await websocket.close(code=1013)
     except Exception as e:
         logger.error(f"Unexpected error: {e}\nCall stack:\n{traceback.format_exc()}")
         await websocket.close()
     finally:
-        audio_buffer = np.array([], dtype=np.float32)
-        audio_vad = np.array([], dtype=np.float32)
-        cache.clear()
+        if decoder is not None:
+            pump.cancel()
+            await asyncio.gather(pump, return_exceptions=True)
+            await decoder.close()
+        if processor is not None:
+            processor.cancel()
+            # The session goes back to the pool, so wait until nothing uses it.
+            await asyncio.gather(processor, return_exceptions=True)
+        if session is not None:
+            session_pool.release(session)
+        if pending.dropped or pending.merged:
+            logger.info(
+                f"[backpressure] dropped: {pending.dropped}; merged: {pending.merged}"
+            )
         logger.info("Cleaned up resources after WebSocket disconnect")
 
 
@@ -447,8 +753,53 @@ if __name__ == "__main__":
     parser.add_argument(
         "--port", type=int, default=8102, help="Port number to run the FastAPI app on."
     )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Worker processes sharing the loaded models."
+    )
+    parser.add_argument(
+        "--worker-threads",
+        type=int,
+        default=0,
+        help=(
+            "CPU threads per torch / ONNX Runtime call in a worker, default "
+            "cores // (workers * concurrent calls per worker)."
+        ),
+    )
     # parser.add_argument('--certfile', type=str, default='path_to_your_SSL_certificate_file.crt', help='SSL certificate file')
     # parser.add_argument('--keyfile', type=str, default='path_to_your_SSL_certificate_file.key', help='SSL key file')
     args = parser.parse_args()
     # uvicorn.run(app, host="0.0.0.0", port=args.port, ssl_certfile=args.certfile, ssl_keyfile=args.keyfile)
-    uvicorn.run(app, host="0.0.0.0", port=args.port)
+    if args.workers > 1:
+        # Every executor, VAD and batch thread of a worker can be inside a torch
+        # op at once and each brings its own intra-op threads, so split the
+        # cores between all of them, not just between the workers.
+        callers = config.executor_workers + config.vad_workers + config.batch_workers
+        worker_threads = args.worker_threads or max(
+            1, available_cpus() // (args.workers * callers)
+        )
+        config.intra_op_threads = config.intra_op_threads or worker_threads
+        # Keep the parent single-threaded: a thread pool started before fork
+        # does not exist in the children and can leave them hanging.
+        torch.set_num_threads(1)
+        # ONNX Runtime sessions own thread pools, so each worker builds its own.
+        shared_models = [
+            name
+            for name in preload_models
+            if not (name == "asr_backend" and config.asr_backend.startswith("onnx"))
+        ]
+        started = time.perf_counter()
+        models.load_all(shared_models)
+        logger.info(
+            f"[models] loaded {shared_models} in {time.perf_counter() - started:.2f}s before fork"
+        )
+
+        def on_worker_start(index):
+            set_cpu_threads(config.intra_op_threads, config.inter_op_threads)
+            logger.info(
+                f"[worker {index}] pid: {os.getpid()}; torch threads: {torch.get_num_threads()} "
+                f"x {callers} concurrent calls"
+            )
+
+        run_prefork(app, "0.0.0.0", args.port, args.workers, on_worker_start)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=args.port)
@@ -0,0 +1,153 @@
+import time
+
+import numpy as np
+import torch
+from loguru import logger
+
+from ring_buffer import AudioRingBuffer
+from speaker import SegmentEmbedding
+
+
+def _state_nbytes(obj, seen=None) -> int:
+    """Approximate bytes held by tensors/arrays reachable from a model cache."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, torch.Tensor):
+        return obj.element_size() * obj.nelement()
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(_state_nbytes(v, seen) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(_state_nbytes(v, seen) for v in obj)
+    if hasattr(obj, "__dict__") and not (callable(obj) or isinstance(obj, torch.nn.Module)):
+        return _state_nbytes(vars(obj), seen)
+    return 0
+
+
+class StreamSession:
+    """State of one /ws/transcribe connection.
+
+    Owns the audio ring buffer, the streaming VAD and ASR caches, the running
+    speaker embedding of the current segment, the current VAD segment
+    boundaries (absolute milliseconds) and a few counters. Sessions are
+    recycled by `SessionPool`; `reset` returns one to the freshly constructed
+    state, shrinking the audio buffer back to its initial size so parked
+    sessions stay small.
+    """
+
+    __slots__ = (
+        "audio",
+        "vad_cache",
+        "asr_cache",
+        "sv_state",
+        "sv",
+        "lang",
+        "partial",
+        "last_vad_beg",
+        "last_vad_end",
+        "hit",
+        "chunks",
+        "segments",
+        "started",
+    )
+
+    def __init__(self, buffer_samples: int):
+        self.audio = AudioRingBuffer(buffer_samples)
+        self.vad_cache = {}
+        self.asr_cache = {}
+        self.sv_state = SegmentEmbedding()
+        self.reset()
+
+    def reset(self):
+        self.audio.reset()
+        self.vad_cache.clear()
+        self.asr_cache.clear()
+        self.sv_state.reset()
+        self.sv = False
+        self.lang = "auto"
+        self.partial = False
+        self.last_vad_beg = self.last_vad_end = -1
+        self.hit = False
+        self.chunks = 0
+        self.segments = 0
+        self.started = time.time()
+
+    def end_segment(self):
+        """Forget the current VAD segment once it has been transcribed."""
+        self.last_vad_beg = self.last_vad_end = -1
+        self.hit = False
+        self.asr_cache.clear()
+        self.sv_state.reset()
+        self.segments += 1
+
+    def nbytes(self) -> int:
+        return (
+            self.audio.nbytes
+            + _state_nbytes(self.vad_cache)
+            + _state_nbytes(self.asr_cache)
+            + _state_nbytes(self.sv_state.total)
+        )
+
+
+class SessionLimitError(RuntimeError):
+    pass
+
+
+class SessionPool:
+    """Recycles `StreamSession` objects across connections.
+
+    At most `max_sessions` sessions are active at once (0 for no limit); released
+    sessions are reset and kept for reuse until `max_idle` are parked.
+    """
+
+    def __init__(self, buffer_samples: int, max_sessions: int = 0, max_idle: int = 64):
+        self.buffer_samples = buffer_samples
+        self.max_sessions = max_sessions
+        self.max_idle = max_idle
+        self._idle = []
+        self._active = set()
+        self.created = 0
+        self.reused = 0
+        self.peak_session_bytes = 0
+
+    def acquire(self, sv: bool = False, lang: str = "auto", partial: bool = False) -> StreamSession:
+        if self.max_sessions and len(self._active) >= self.max_sessions:
+            raise SessionLimitError(f"session limit reached: {self.max_sessions}")
+        if self._idle:
+            session = self._idle.pop()
+            self.reused += 1
+        else:
+            session = StreamSession(self.buffer_samples)
+            self.created += 1
+        session.sv = sv
+        session.lang = lang
+        session.partial = partial
+        self._active.add(session)
+        return session
+
+    def release(self, session: StreamSession):
+        self._active.discard(session)
+        session_bytes = session.nbytes()
+        self.peak_session_bytes = max(self.peak_session_bytes, session_bytes)
+        logger.info(
+            f"[session] chunks: {session.chunks}; segments: {session.segments}; "
+            f"bytes: {session_bytes}; duration: {time.time() - session.started:.1f}s"
+        )
+        session.reset()
+        if len(self._idle) < self.max_idle:
+            self._idle.append(session)
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._active),
+            "idle": len(self._idle),
+            "created": self.created,
+            "reused": self.reused,
+            "active_bytes": sum(s.nbytes() for s in self._active),
+            "idle_bytes": sum(s.nbytes() for s in self._idle),
+            "peak_session_bytes": self.peak_session_bytes,
+        }
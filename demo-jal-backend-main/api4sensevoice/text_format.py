@@ -0,0 +1,280 @@
+import random
+import re
+import time
+
+emo_dict = {
+    "<|HAPPY|>": "😊",
+    "<|SAD|>": "😔",
+    "<|ANGRY|>": "😡",
+    "<|NEUTRAL|>": "",
+    "<|FEARFUL|>": "😰",
+    "<|DISGUSTED|>": "🤢",
+    "<|SURPRISED|>": "😮",
+}
+
+event_dict = {
+    "<|BGM|>": "🎼",
+    "<|Speech|>": "",
+    "<|Applause|>": "👏",
+    "<|Laughter|>": "😀",
+    "<|Cry|>": "😭",
+    "<|Sneeze|>": "🤧",
+    "<|Breath|>": "",
+    "<|Cough|>": "🤧",
+}
+
+emoji_dict = {
+    "<|nospeech|><|Event_UNK|>": "❓",
+    "<|zh|>": "",
+    "<|en|>": "",
+    "<|yue|>": "",
+    "<|ja|>": "",
+    "<|ko|>": "",
+    "<|nospeech|>": "",
+    "<|HAPPY|>": "😊",
+    "<|SAD|>": "😔",
+    "<|ANGRY|>": "😡",
+    "<|NEUTRAL|>": "",
+    "<|BGM|>": "🎼",
+    "<|Speech|>": "",
+    "<|Applause|>": "👏",
+    "<|Laughter|>": "😀",
+    "<|FEARFUL|>": "😰",
+    "<|DISGUSTED|>": "🤢",
+    "<|SURPRISED|>": "😮",
+    "<|Cry|>": "😭",
+    "<|EMO_UNKNOWN|>": "",
+    "<|Sneeze|>": "🤧",
+    "<|Breath|>": "",
+    "<|Cough|>": "😷",
+    "<|Sing|>": "",
+    "<|Speech_Noise|>": "",
+    "<|withitn|>": "",
+    "<|woitn|>": "",
+    "<|GBG|>": "",
+    "<|Event_UNK|>": "",
+}
+
+lang_dict = {
+    "<|zh|>": "<|lang|>",
+    "<|en|>": "<|lang|>",
+    "<|yue|>": "<|lang|>",
+    "<|ja|>": "<|lang|>",
+    "<|ko|>": "<|lang|>",
+    "<|nospeech|>": "<|lang|>",
+}
+
+emo_set = {"😊", "😔", "😡", "😰", "🤢", "😮"}
+event_set = {
+    "🎼",
+    "👏",
+    "😀",
+    "😭",
+    "🤧",
+    "😷",
+}
+
+
+def format_str(s):
+    for sptk in emoji_dict:
+        s = s.replace(sptk, emoji_dict[sptk])
+    return s
+
+
+def format_str_v2(s):
+    sptk_dict = {}
+    for sptk in emoji_dict:
+        sptk_dict[sptk] = s.count(sptk)
+        s = s.replace(sptk, "")
+    emo = "<|NEUTRAL|>"
+    for e in emo_dict:
+        if sptk_dict[e] > sptk_dict[emo]:
+            emo = e
+    for e in event_dict:
+        if sptk_dict[e] > 0:
+            s = event_dict[e] + s
+    s = s + emo_dict[emo]
+
+    for emoji in emo_set.union(event_set):
+        s = s.replace(" " + emoji, emoji)
+        s = s.replace(emoji + " ", emoji)
+    return s.strip()
+
+
+def format_str_v3(s):
+    def get_emo(s):
+        return s[-1] if s[-1] in emo_set else None
+
+    def get_event(s):
+        return s[0] if s[0] in event_set else None
+
+    s = s.replace("<|nospeech|><|Event_UNK|>", "❓")
+    for lang in lang_dict:
+        s = s.replace(lang, "<|lang|>")
+    s_list = [format_str_v2(s_i).strip(" ") for s_i in s.split("<|lang|>")]
+    new_s = " " + s_list[0]
+    cur_ent_event = get_event(new_s)
+    for i in range(1, len(s_list)):
+        if len(s_list[i]) == 0:
+            continue
+        if get_event(s_list[i]) == cur_ent_event and get_event(s_list[i]) != None:
+            s_list[i] = s_list[i][1:]
+        # else:
+        cur_ent_event = get_event(s_list[i])
+        if get_emo(s_list[i]) != None and get_emo(s_list[i]) == get_emo(new_s):
+            new_s = new_s[:-1]
+        new_s += s_list[i].strip().lstrip()
+    new_s = new_s.replace("The.", " ")
+    return new_s.strip()
+
+
+# format_str_v3 in one regex pass. Every special token is matched once;
+# lang tags split segments, the other tokens are counted per segment and dropped.
+_TOKEN_RE = re.compile(r"<\|nospeech\|><\|Event_UNK\|>|<\|[^<>|]*\|>")
+_EMOJI_CLASS = "[" + "".join(sorted(emo_set | event_set)) + "]"
+_EMOJI_RE = re.compile(_EMOJI_CLASS)
+# One space is dropped on each side of an emoji (a single space between two emoji
+# is dropped once), as the per-emoji `str.replace` calls of format_str_v2 do.
+_EMOJI_SPACE_RE = re.compile(f"(?<={_EMOJI_CLASS}) | (?={_EMOJI_CLASS})")
+_EVENTS = list(event_dict.items())[::-1]
+_EMOS = list(emo_dict)
+
+
+class _FallBack(Exception):
+    pass
+
+
+def _format_segment(text: str, counts: dict) -> str:
+    """format_str_v2 of one segment, given its text and token counts."""
+    emo = "<|NEUTRAL|>"
+    for e in _EMOS:
+        if e in counts and counts[e] > counts.get(emo, 0):
+            emo = e
+    prefix = "".join(emoji for e, emoji in _EVENTS if e in counts)
+    suffix = emo_dict[emo]
+    s = prefix + text + suffix
+    if prefix or suffix or _EMOJI_RE.search(text):
+        s = _EMOJI_SPACE_RE.sub("", s)
+    return s.strip().strip(" ")
+
+
+def _split_segments(s: str) -> list:
+    segments = []
+    text, counts = [], {}
+    pos = 0
+    for m in _TOKEN_RE.finditer(s):
+        piece = s[pos : m.start()]
+        if "<" in piece:
+            # Deleting tokens around a stray "<" could form new tokens; only
+            # the sequential replaces of format_str_v3 get that right.
+            raise _FallBack
+        text.append(piece)
+        pos = m.end()
+        token = m.group()
+        if token in lang_dict:
+            segments.append(("".join(text), counts))
+            text, counts = [], {}
+        elif token == "<|nospeech|><|Event_UNK|>":
+            text.append("❓")
+        elif token in emoji_dict:
+            counts[token] = counts.get(token, 0) + 1
+        else:
+            raise _FallBack
+    piece = s[pos:]
+    if "<" in piece:
+        raise _FallBack
+    text.append(piece)
+    segments.append(("".join(text), counts))
+    return segments
+
+
+def format_str_v4(s):
+    """Same output as format_str_v3, computed in a single pass over `s`.
+
+    Falls back to format_str_v3 for text containing "<" outside well-formed
+    tokens, which SenseVoice does not produce.
+    """
+    try:
+        segments = _split_segments(s)
+    except _FallBack:
+        return format_str_v3(s)
+
+    def get_emo(s):
+        return s[-1] if s[-1] in emo_set else None
+
+    def get_event(s):
+        return s[0] if s[0] in event_set else None
+
+    s_list = [_format_segment(text, counts) for text, counts in segments]
+    new_s = " " + s_list[0]
+    cur_ent_event = get_event(new_s)
+    for i in range(1, len(s_list)):
+        if len(s_list[i]) == 0:
+            continue
+        if get_event(s_list[i]) == cur_ent_event and get_event(s_list[i]) != None:
+            s_list[i] = s_list[i][1:]
+        cur_ent_event = get_event(s_list[i])
+        if get_emo(s_list[i]) != None and get_emo(s_list[i]) == get_emo(new_s):
+            new_s = new_s[:-1]
+        new_s += s_list[i].strip()
+    new_s = new_s.replace("The.", " ")
+    return new_s.strip()
+
+
+if __name__ == "__main__":
+    # Randomized equivalence check against format_str_v3, then a benchmark.
+    tokens = list(emoji_dict) + ["<|lang|>"]
+    pieces = ["", " ", "  ", "hello", "The.", "你好", "。", "、", "a b", "\n", "<", "|>", "<|"]
+    pieces += sorted(emo_set | event_set) + ["❓"]
+    rng = random.Random(0)
+    checked = fallbacks = 0
+    for _ in range(200000):
+        parts = rng.choices(tokens + pieces, k=rng.randint(0, 12))
+        s = "".join(parts)
+        try:
+            expected = format_str_v3(s)
+        except IndexError:
+            expected = IndexError
+        try:
+            actual = format_str_v4(s)
+        except IndexError:
+            actual = IndexError
+        assert actual == expected, (s, expected, actual)
+        checked += 1
+        try:
+            _split_segments(s)
+        except _FallBack:
+            fallbacks += 1
+    print(f"equivalence: {checked} random strings ok ({fallbacks} used the fallback)")
+
+    # Shapes of SenseVoice results: one tag block per language segment.
+    langs = ["<|zh|>", "<|en|>", "<|ja|>", "<|ko|>", "<|yue|>"]
+    emos = ["<|NEUTRAL|>", "<|HAPPY|>", "<|SAD|>", "<|ANGRY|>", "<|EMO_UNKNOWN|>"]
+    events = ["<|Speech|>", "<|BGM|>", "<|Laughter|>", "<|Applause|>"]
+    texts = [
+        "今天的会议主要讨论下个季度的预算安排。",
+        "Let's move on to the next item on the agenda.",
+        "はい、承知しました。",
+        "好的，我们下周再确认一下。",
+        "I think the main concern is the delivery schedule, right?",
+    ]
+    corpus = ["<|nospeech|><|Event_UNK|>", "<|en|><|EMO_UNKNOWN|><|Speech|><|woitn|>"]
+    for _ in range(998):
+        corpus.append(
+            "".join(
+                rng.choice(langs)
+                + rng.choice(emos)
+                + rng.choice(events)
+                + rng.choice(["<|withitn|>", "<|woitn|>"])
+                + rng.choice(texts)
+                for _ in range(rng.choice([1, 1, 1, 2, 3]))
+            )
+        )
+    assert all(format_str_v4(s) == format_str_v3(s) for s in corpus)
+    for fn in (format_str_v3, format_str_v4):
+        started = time.perf_counter()
+        for _ in range(20):
+            for s in corpus:
+                fn(s)
+        elapsed = (time.perf_counter() - started) / (20 * len(corpus))
+        print(f"{fn.__name__}: {elapsed * 1e6:.2f} us/result")
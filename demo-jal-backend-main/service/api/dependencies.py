@@ -0,0 +1,37 @@
+import hmac
+from typing import Optional
+from fastapi import Header, Request
+from service.core.config import settings
+from service.core.exceptions import APIException, ResourceNotFoundException
+from service.tools.extract_query import ExtractQuery
+from service.tools.result_cache import ResultCache
+from service.tools.single_flight import SingleFlight
+
+
+def get_extract_query(request: Request) -> ExtractQuery:
+    """返回应用启动时创建的 ExtractQuery 实例"""
+    return request.app.state.extract_query
+
+
+def get_result_cache(request: Request) -> ResultCache:
+    """返回应用启动时创建的结果缓存，未启用时返回404"""
+    cache = request.app.state.result_cache
+    if cache is None:
+        raise ResourceNotFoundException(resource_type="result_cache", resource_id="default")
+    return cache
+
+
+def get_single_flight(request: Request) -> SingleFlight:
+    """返回应用启动时创建的请求合并器，未启用时返回404"""
+    single_flight = request.app.state.single_flight
+    if single_flight is None:
+        raise ResourceNotFoundException(resource_type="single_flight", resource_id="default")
+    return single_flight
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """校验管理接口的访问令牌；未配置 ADMIN_TOKEN 时拒绝所有请求"""
+    if not settings.admin_token:
+        raise APIException(message="管理接口未启用，请设置 ADMIN_TOKEN", code=403)
+    if not hmac.compare_digest(x_admin_token or "", settings.admin_token):
+        raise APIException(message="管理令牌无效", code=403)
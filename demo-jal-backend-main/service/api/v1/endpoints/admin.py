@@ -0,0 +1,52 @@
+from fastapi import Depends
+from service.schemas.schemas import AnswerRequest
+from service.api.dependencies import (
+    get_extract_query,
+    get_result_cache,
+    get_single_flight,
+    require_admin,
+)
+from service.tools.extract_query import ExtractQuery
+from service.tools.result_cache import ResultCache
+from service.tools.single_flight import SingleFlight
+
+async def cache_stats(
+    cache: ResultCache = Depends(get_result_cache), _=Depends(require_admin)
+):
+    """返回结果缓存的命中率等统计信息"""
+    return cache.stats()
+
+
+async def invalidate_cache(
+    cache: ResultCache = Depends(get_result_cache), _=Depends(require_admin)
+):
+    """清空结果缓存"""
+    return {"removed": await cache.ainvalidate()}
+
+
+async def invalidate_cache_key(
+    key: str, cache: ResultCache = Depends(get_result_cache), _=Depends(require_admin)
+):
+    """按缓存键删除一条结果"""
+    return {"removed": await cache.ainvalidate(key)}
+
+
+async def invalidate_cache_query(
+    answer_request: AnswerRequest,
+    cache: ResultCache = Depends(get_result_cache),
+    extract_query: ExtractQuery = Depends(get_extract_query),
+    _=Depends(require_admin),
+):
+    """删除某段转译内容（所有片段）的提取结果，下次请求时重新调用LLM"""
+    keys = extract_query.cache_keys(answer_request.query)
+    removed = 0
+    for key in keys:
+        removed += await cache.ainvalidate(key)
+    return {"keys": keys, "removed": removed}
+
+
+async def single_flight_stats(
+    single_flight: SingleFlight = Depends(get_single_flight), _=Depends(require_admin)
+):
+    """返回执行中的LLM请求数和被合并的请求数"""
+    return single_flight.stats()
@@ -1,4 +1,4 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from service.schemas.schemas import (
     AnswerRequest,
     AnswerResponse,
@@ -6,6 +6,7 @@ from service.schemas.schemas import (
     RegenerateResponse,
 )
 from service.tools.extract_query import ExtractQuery
+from service.api.dependencies import get_extract_query
 from service.core.exceptions import (
     ServiceException,
     ValidationException,
@@ -29,10 +30,12 @@ router = APIRouter()
 
 
 @router.post("/generate_answer")
-async def generate_answer(answer_request: AnswerRequest) -> AnswerResponse:
+async def generate_answer(
+    answer_request: AnswerRequest,
+    extract_query: ExtractQuery = Depends(get_extract_query),
+) -> AnswerResponse:
     """生成回答的API端点"""
     start_time = time.time()
-    extract_query = ExtractQuery()
 
     try:
         # 验证请求
@@ -45,8 +48,8 @@ async def generate_answer(answer_request: AnswerRequest) -> AnswerResponse:
 
         # 提取客户问题
         try:
-            client_queries = extract_query.extract_informations(
-                answer_request.query, "openai"
+            client_queries = (
+                await extract_query.aextract_informations(answer_request.query, "openai")
             )["questions"]
             logger.info(f"提取到 {len(client_queries)} 个信息")
             # 展示所有提取的问题
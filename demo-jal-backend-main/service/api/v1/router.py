@@ -1,6 +1,18 @@
 from fastapi import APIRouter
 from service.api.v1.endpoints.routes import generate_answer
+from service.api.v1.endpoints.admin import (
+    cache_stats,
+    invalidate_cache,
+    invalidate_cache_key,
+    invalidate_cache_query,
+    single_flight_stats,
+)
 
 router = APIRouter()
 
-router.add_api_route("/generate_answer", generate_answer, methods=["POST"])
\ No newline at end of file
+router.add_api_route("/generate_answer", generate_answer, methods=["POST"])
+router.add_api_route("/admin/cache", cache_stats, methods=["GET"])
+router.add_api_route("/admin/cache", invalidate_cache, methods=["DELETE"])
+router.add_api_route("/admin/cache/invalidate", invalidate_cache_query, methods=["POST"])
+router.add_api_route("/admin/cache/{key}", invalidate_cache_key, methods=["DELETE"])
+router.add_api_route("/admin/single_flight", single_flight_stats, methods=["GET"])
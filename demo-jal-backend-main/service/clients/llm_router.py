@@ -1,5 +1,6 @@
-from service.clients.openai_api import OpenAIClient
+from service.clients.openai_api import OpenAIClient, AsyncOpenAIClient
 from service.core.exceptions import LLMException, ProviderNotFoundException
+from service.tools.result_cache import make_cache_key
 import logging
 import os
 
@@ -7,9 +8,50 @@ import os
 logger = logging.getLogger("llm_router")
 
 
+def resolve_deployment(provider, mode):
+    """根据模式返回OpenAI部署名称"""
+    logger.info(f"LLM请求路由到OpenAI, 模式: {mode}")
+    if provider != "openai":
+        logger.warning(f"请求的提供商 {provider} 已被忽略，将使用OpenAI")
+
+    if mode == "chat":
+        logger.debug("使用OpenAI聊天模式")
+        return os.getenv("DEPLOYMENT_4O", "gpt-4o")
+    elif mode == "reasoning":
+        logger.debug("使用OpenAI思考模式")
+        return os.getenv("DEPLOYMENT_o1", "o1")
+    else:
+        raise ValueError(f"未知模式: {mode}")
+
+
+def to_router_exception(e, mode):
+    """将非LLM异常包装为LLM异常"""
+    if isinstance(e, LLMException):
+        # 已经是LLM异常，直接抛出
+        return e
+    # 其他未知异常
+    logger.error(f"LLM生成时发生错误: {str(e)}")
+    return LLMException(
+        message=f"LLM生成时发生错误: {str(e)}",
+        provider="openai",
+        details={"mode": mode},
+    )
+
+
+def request_key(system_prompt, user_prompt, response_format, temperature, model):
+    """返回请求的内容键，用于结果缓存和合并相同请求
+
+    temperature 不为0时结果不确定，返回 None，既不缓存也不合并。
+    """
+    if temperature != 0:
+        return None
+    return make_cache_key(system_prompt, user_prompt, model, temperature, response_format)
+
+
 class LLMRouter:
-    def __init__(self):
-        self.openai_client = OpenAIClient()
+    def __init__(self, openai_client=None, cache=None):
+        self.openai_client = openai_client or OpenAIClient()
+        self.cache = cache
         logger.info("LLM路由器初始化完成")
 
     def generate(
@@ -22,40 +64,72 @@ class LLMRouter:
         mode="chat",
     ):
         """LLM请求 - 只使用OpenAI"""
-        logger.info(f"LLM请求路由到OpenAI, 模式: {mode}")
+        try:
+            model = resolve_deployment(provider, mode)
+            key = request_key(system_prompt, user_prompt, response_format, temperature, model)
+            if key is not None and self.cache is not None:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    logger.info(f"命中结果缓存: {key}")
+                    return cached
+
+            result = self.openai_client.generate(
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                response_format=response_format,
+                temperature=temperature,
+                model=model,
+            )
+            if key is not None and self.cache is not None:
+                self.cache.set(key, result)
+            return result
+        except Exception as e:
+            raise to_router_exception(e, mode)
 
+
+class AsyncLLMRouter:
+    """LLMRouter 的异步版本"""
+
+    def __init__(self, openai_client=None, cache=None, single_flight=None):
+        self.openai_client = openai_client or AsyncOpenAIClient()
+        self.cache = cache
+        self.single_flight = single_flight
+        logger.info("LLM异步路由器初始化完成")
+
+    async def generate(
+        self,
+        system_prompt,
+        user_prompt,
+        response_format=None,
+        temperature=1.0,
+        provider="openai",
+        mode="chat",
+    ):
+        """LLM请求 - 只使用OpenAI"""
         try:
-            if provider != "openai":
-                logger.warning(f"请求的提供商 {provider} 已被忽略，将使用OpenAI")
-                
-            if mode == "chat":
-                logger.debug("使用OpenAI聊天模式")
-                return self.openai_client.generate(
-                    system_prompt=system_prompt,
-                    user_prompt=user_prompt,
-                    response_format=response_format,
-                    temperature=temperature,
-                    model=os.getenv("DEPLOYMENT_4O", "gpt-4o"),
-                )
-            elif mode == "reasoning":
-                logger.debug("使用OpenAI思考模式")
-                return self.openai_client.generate(
+            model = resolve_deployment(provider, mode)
+            key = request_key(system_prompt, user_prompt, response_format, temperature, model)
+            if key is not None and self.cache is not None:
+                cached = await self.cache.aget(key)
+                if cached is not None:
+                    logger.info(f"命中结果缓存: {key}")
+                    return cached
+
+            async def call():
+                result = await self.openai_client.generate(
                     system_prompt=system_prompt,
                     user_prompt=user_prompt,
                     response_format=response_format,
                     temperature=temperature,
-                    model=os.getenv("DEPLOYMENT_o1", "o1"),
+                    model=model,
                 )
-            else:
-                raise ValueError(f"未知模式: {mode}")
-        except LLMException:
-            # 已经是LLM异常，直接抛出
-            raise
+                if key is not None and self.cache is not None:
+                    await self.cache.aset(key, result)
+                return result
+
+            if key is not None and self.single_flight is not None:
+                # 相同请求正在执行时等待其结果，不再调用LLM
+                return await self.single_flight.do(key, call)
+            return await call()
         except Exception as e:
-            # 其他未知异常
-            logger.error(f"LLM生成时发生错误: {str(e)}")
-            raise LLMException(
-                message=f"LLM生成时发生错误: {str(e)}",
-                provider="openai",
-                details={"mode": mode},
-            )
+            raise to_router_exception(e, mode)
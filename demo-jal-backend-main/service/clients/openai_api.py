@@ -1,13 +1,65 @@
 import openai
+import httpx
 import os
 import json
 import logging
+import importlib.util
+from service.core.config import settings
 from service.tools.retry import retry_with_backoff
 from service.core.exceptions import LLMException, ProviderTimeoutException
 
 # 配置日志
 logger = logging.getLogger("openai_client")
 
+
+def to_llm_exception(e, model, prompt):
+    """将调用OpenAI API时的异常转换为LLM异常"""
+    if isinstance(e, openai.APITimeoutError):
+        logger.error(f"OpenAI API超时: {str(e)}")
+        return ProviderTimeoutException(
+            provider="openai",
+            timeout=60,  # 假设超时时间为60秒
+            details={"model": model}
+        )
+    if isinstance(e, openai.APIError):
+        logger.error(f"OpenAI API错误: {str(e)}")
+        return LLMException(
+            message=f"OpenAI API错误: {str(e)}",
+            provider="openai",
+            details={"model": model}
+        )
+    logger.error(f"调用OpenAI API时发生错误: {str(e)}")
+    logger.error(f"提示词: {prompt}")
+    return LLMException(
+        message=f"调用OpenAI API时发生错误: {str(e)}",
+        provider="openai",
+        details={"model": model}
+    )
+
+
+def create_http_client():
+    """创建应用生命周期内共享的异步HTTP连接池
+
+    连接保持 keep-alive，在请求之间复用，避免每个请求重新进行TCP/TLS握手。
+    安装了 h2 时使用 HTTP/2，多个请求可复用同一个连接。
+    """
+    http2 = settings.llm_http2 and importlib.util.find_spec("h2") is not None
+    if settings.llm_http2 and not http2:
+        logger.warning("未安装 h2，LLM连接池使用 HTTP/1.1")
+    http_client = openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=settings.llm_max_connections,
+            max_keepalive_connections=settings.llm_max_keepalive_connections,
+            keepalive_expiry=settings.llm_keepalive_expiry,
+        ),
+        http2=http2,
+    )
+    logger.info(
+        f"LLM连接池初始化完成, 最大连接数: {settings.llm_max_connections}, HTTP/2: {http2}"
+    )
+    return http_client
+
+
 class OpenAIClient:
     def __init__(self):
         self.client = openai.AzureOpenAI(
@@ -45,28 +97,8 @@ class OpenAIClient:
                         system_prompt, user_prompt, temperature, model
                     )
 
-        except openai.APITimeoutError as e:
-            logger.error(f"OpenAI API超时: {str(e)}")
-            raise ProviderTimeoutException(
-                provider="openai",
-                timeout=60,  # 假设超时时间为60秒
-                details={"model": model}
-            )
-        except openai.APIError as e:
-            logger.error(f"OpenAI API错误: {str(e)}")
-            raise LLMException(
-                message=f"OpenAI API错误: {str(e)}",
-                provider="openai",
-                details={"model": model}
-            )
         except Exception as e:
-            logger.error(f"调用OpenAI API时发生错误: {str(e)}")
-            logger.error(f"提示词: {system_prompt + user_prompt}")
-            raise LLMException(
-                message=f"调用OpenAI API时发生错误: {str(e)}",
-                provider="openai",
-                details={"model": model}
-            )
+            raise to_llm_exception(e, model, system_prompt + user_prompt)
 
     @retry_with_backoff(max_retries=3, base_delay=2, max_delay=30)
     def o1_generate(self, prompt):
@@ -125,6 +157,113 @@ class OpenAIClient:
             raise
 
 
+class AsyncOpenAIClient:
+    """OpenAIClient 的异步版本，基于 AsyncAzureOpenAI
+
+    等待模型响应时不会阻塞事件循环，一个 worker 可以同时处理大量请求。
+    http_client 为 create_http_client() 创建的共享连接池；不传时使用
+    openai 自带的连接池。
+    """
+
+    def __init__(self, http_client=None):
+        self.client = openai.AsyncAzureOpenAI(
+            api_key=os.environ['OPENAI_API_KEY'],
+            azure_endpoint=os.environ['AZURE_OPENAI_ENDPOINT'],
+            api_version=os.environ['OPENAI_API_VERSION'],
+            # 超时由 openai 按请求设置，写在 http_client 上会被覆盖
+            timeout=httpx.Timeout(settings.llm_timeout, connect=settings.llm_connect_timeout),
+            http_client=http_client,
+        )
+        logger.info("OpenAI异步客户端初始化完成")
+
+    async def generate(
+        self,
+        system_prompt,
+        user_prompt,
+        response_format,
+        temperature,
+        model,
+    ):
+        """生成回复"""
+        logger.info(f"异步调用OpenAI API，模型: {model}")
+
+        try:
+            if response_format:
+                logger.debug("使用格式化响应")
+                return await self.format_generate(
+                    system_prompt, user_prompt, model, temperature, response_format
+                )
+            else:
+                logger.debug("使用标准响应")
+                if model == os.environ["DEPLOYMENT_o1"]:
+                    logger.debug("调用思考模型")
+                    return await self.o1_generate(system_prompt + user_prompt)
+                else:
+                    logger.debug("调用基础聊天模型")
+                    return await self.not_o1_generate(
+                        system_prompt, user_prompt, temperature, model
+                    )
+
+        except Exception as e:
+            raise to_llm_exception(e, model, system_prompt + user_prompt)
+
+    @retry_with_backoff(max_retries=3, base_delay=2, max_delay=30)
+    async def o1_generate(self, prompt):
+        """使用o1模型生成回复，带重试机制"""
+        try:
+            response = await self.client.chat.completions.create(
+                model=os.environ["DEPLOYMENT_o1"],
+                messages=[{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.warning(f"o1模型生成失败，将重试: {str(e)}")
+            raise
+
+    @retry_with_backoff(max_retries=3, base_delay=2, max_delay=30)
+    async def not_o1_generate(self, system_prompt, user_prompt, temperature, model_deploy):
+        """使用非o1模型生成回复，带重试机制"""
+        try:
+            completion = await self.client.chat.completions.create(
+                model=model_deploy,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                temperature=temperature,
+            )
+            return completion.choices[0].message.content
+        except Exception as e:
+            logger.warning(f"模型 {model_deploy} 生成失败，将重试: {str(e)}")
+            raise
+
+    @retry_with_backoff(max_retries=3, base_delay=2, max_delay=30)
+    async def format_generate(self, system_prompt, user_prompt, model_deploy, temperature, response_format):
+        """使用格式化响应生成回复，带重试机制"""
+        try:
+            completion = await self.client.beta.chat.completions.parse(
+                model=model_deploy,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                temperature=temperature,
+                response_format=response_format,
+            )
+            json_output = json.loads(completion.choices[0].message.content)
+            return json_output
+        except json.JSONDecodeError as e:
+            logger.error(f"解析JSON响应失败: {str(e)}")
+            raise LLMException(
+                message="解析模型响应为JSON格式失败",
+                provider="openai",
+                details={"model": model_deploy}
+            )
+        except Exception as e:
+            logger.warning(f"格式化生成失败，将重试: {str(e)}")
+            raise
+
+
 if __name__ == "__main__":
     # 配置测试日志
     test_logger = logging.getLogger("openai_test")
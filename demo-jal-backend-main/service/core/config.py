@@ -1,3 +1,4 @@
+import os
 from typing import Dict, Any
 
 
@@ -6,6 +7,38 @@ class Settings:
 
     provider: str = "openai"
 
+    # Shared HTTP connection pool for LLM calls
+    llm_max_connections: int = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+    llm_max_keepalive_connections: int = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    llm_keepalive_expiry: float = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+    llm_timeout: float = float(os.getenv("LLM_TIMEOUT", "60"))
+    llm_connect_timeout: float = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+    # HTTP/2 needs the h2 package (pip install "httpx[http2]")
+    llm_http2: bool = os.getenv("LLM_HTTP2", "false").lower() in ("1", "true", "yes")
+
+    # LLM result cache (only temperature=0 requests are cached)
+    llm_cache_enabled: bool = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+    llm_cache_max_entries: int = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+    # Approximate memory of the in-process tier (JSON size of the results)
+    llm_cache_max_bytes: int = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 2**20)))
+    llm_cache_ttl: float = float(os.getenv("LLM_CACHE_TTL", "86400"))
+    # SQLite file shared by workers; empty keeps the cache in memory only
+    llm_cache_path: str = os.getenv("LLM_CACHE_PATH", "")
+    llm_cache_max_disk_entries: int = int(os.getenv("LLM_CACHE_MAX_DISK_ENTRIES", "10000"))
+
+    # Coalesce concurrent identical LLM requests into one upstream call
+    llm_single_flight: bool = os.getenv("LLM_SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+
+    # Long transcripts are split into overlapping chunks extracted in parallel;
+    # 0 disables chunking
+    llm_chunk_chars: int = int(os.getenv("LLM_CHUNK_CHARS", "6000"))
+    llm_chunk_overlap_chars: int = int(os.getenv("LLM_CHUNK_OVERLAP_CHARS", "500"))
+    llm_chunk_concurrency: int = int(os.getenv("LLM_CHUNK_CONCURRENCY", "8"))
+
+    # Token for the admin endpoints (X-Admin-Token header); the endpoints
+    # refuse every request while it is empty
+    admin_token: str = os.getenv("ADMIN_TOKEN", "")
+
     def dict(self) -> Dict[str, Any]:
         """Convert settings to dictionary."""
         return {"provider": self.provider}
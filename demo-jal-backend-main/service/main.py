@@ -8,6 +8,13 @@ from service.core.error_handlers import (
     general_exception_handler
 )
 from service.core.exceptions import ServiceException
+from service.clients.openai_api import AsyncOpenAIClient, create_http_client
+from service.clients.llm_router import AsyncLLMRouter
+from service.tools.extract_query import ExtractQuery
+from service.tools.result_cache import ResultCache
+from service.tools.single_flight import SingleFlight
+from service.core.config import settings
+from contextlib import asynccontextmanager
 import logging
 import time
 import os
@@ -44,7 +51,35 @@ root_logger.addHandler(file_handler)
 logger = logging.getLogger("main")
 logger.info(f"日志配置完成，日志文件保存在: {log_file}")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """创建应用生命周期内共享的LLM客户端和连接池"""
+    http_client = create_http_client()
+    app.state.result_cache = None
+    if settings.llm_cache_enabled:
+        app.state.result_cache = ResultCache(
+            max_entries=settings.llm_cache_max_entries,
+            max_bytes=settings.llm_cache_max_bytes,
+            ttl=settings.llm_cache_ttl,
+            path=settings.llm_cache_path or None,
+            max_disk_entries=settings.llm_cache_max_disk_entries,
+        )
+    app.state.single_flight = SingleFlight() if settings.llm_single_flight else None
+    async_llm_router = AsyncLLMRouter(
+        AsyncOpenAIClient(http_client=http_client),
+        cache=app.state.result_cache,
+        single_flight=app.state.single_flight,
+    )
+    app.state.extract_query = ExtractQuery(async_llm_router=async_llm_router)
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+        logger.info("LLM连接池已关闭")
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 注册异常处理器
 app.add_exception_handler(ServiceException, service_exception_handler)
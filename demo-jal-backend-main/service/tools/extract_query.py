@@ -1,11 +1,21 @@
-from service.clients.llm_router import LLMRouter
+import asyncio
+import logging
+from service.clients.llm_router import LLMRouter, AsyncLLMRouter, resolve_deployment
+from service.core.config import settings
+from service.tools.result_cache import make_cache_key
+from service.tools.transcript_chunker import merge_items, split_transcript
 from service.schemas.schemas import ClientQuestions
 
+# 配置日志
+logger = logging.getLogger("extract_query")
+
 
 class ExtractQuery:
-    def __init__(self):
+    def __init__(self, llm_router=None, async_llm_router=None):
         # self.client = OllamaServer()
-        self.llm_router = LLMRouter()
+        # 同步路由器在第一次同步调用时创建，只使用异步接口时不会建立额外的连接池
+        self._llm_router = llm_router
+        self.async_llm_router = async_llm_router or AsyncLLMRouter()
         self.system_prompt = """
         【役割】多人対話内容分析の専門家
 
@@ -55,6 +65,43 @@ class ExtractQuery:
         {conversation_transcript}
         """
 
+        # 长对话切分后每个片段使用的提示词
+        self.chunk_user_prompt = """
+        以下は長い多人対話の文字起こしの一部です。この部分に含まれるすべての重要情報を抽出し、日本語でMarkdown形式の項目として列挙してください：
+        
+        {conversation_transcript}
+        """
+
+    @property
+    def llm_router(self):
+        if self._llm_router is None:
+            self._llm_router = LLMRouter()
+        return self._llm_router
+
+    def user_prompts(self, conversation_transcript):
+        """返回每个片段的用户提示词
+
+        内容超过 settings.llm_chunk_chars 时在发言边界处切分为相互重叠的片段，
+        否则返回包含完整内容的单个提示词。
+        """
+        chunks = [conversation_transcript]
+        if settings.llm_chunk_chars:
+            chunks = split_transcript(
+                conversation_transcript, settings.llm_chunk_chars, settings.llm_chunk_overlap_chars
+            )
+        if len(chunks) <= 1:
+            return [self.user_prompt.format(conversation_transcript=conversation_transcript)]
+        logger.info(f"转译内容共 {len(conversation_transcript)} 字，切分为 {len(chunks)} 个片段")
+        return [self.chunk_user_prompt.format(conversation_transcript=chunk) for chunk in chunks]
+
+    def cache_keys(self, conversation_transcript, provider="openai"):
+        """返回该转译内容（每个片段）的提取结果在缓存中的键"""
+        model = resolve_deployment(provider, "chat")
+        return [
+            make_cache_key(self.system_prompt, user_prompt, model, 0, ClientQuestions)
+            for user_prompt in self.user_prompts(conversation_transcript)
+        ]
+
     def extract_informations(self, conversation_transcript, provider):
         """
         Extract customer questions from a conversation transcript
@@ -65,12 +112,50 @@ class ExtractQuery:
         Returns:
             list: A list of extracted customer questions
         """
-        response = self.llm_router.generate(
-            self.system_prompt,
-            self.user_prompt.format(conversation_transcript=conversation_transcript),
-            response_format=ClientQuestions,
-            temperature=0,
-            provider=provider,
-        )
-
-        return response
+        responses = [
+            self.llm_router.generate(
+                self.system_prompt,
+                user_prompt,
+                response_format=ClientQuestions,
+                temperature=0,
+                provider=provider,
+            )
+            for user_prompt in self.user_prompts(conversation_transcript)
+        ]
+        if len(responses) == 1:
+            return responses[0]
+        return {"questions": merge_items(response["questions"] for response in responses)}
+
+    async def aextract_informations(self, conversation_transcript, provider):
+        """extract_informations 的异步版本，等待模型时不阻塞事件循环
+
+        长对话的各个片段并发提取（最多 settings.llm_chunk_concurrency 个），
+        总耗时取决于片段的耗时而不是对话长度。
+        """
+        user_prompts = self.user_prompts(conversation_transcript)
+        semaphore = asyncio.Semaphore(settings.llm_chunk_concurrency)
+
+        async def extract(user_prompt):
+            async with semaphore:
+                return await self.async_llm_router.generate(
+                    self.system_prompt,
+                    user_prompt,
+                    response_format=ClientQuestions,
+                    temperature=0,
+                    provider=provider,
+                )
+
+        if len(user_prompts) == 1:
+            return await extract(user_prompts[0])
+
+        tasks = [asyncio.ensure_future(extract(user_prompt)) for user_prompt in user_prompts]
+        try:
+            responses = await asyncio.gather(*tasks)
+        except BaseException:
+            # 一个片段失败（或请求被取消）时，取消其余片段
+            for task in tasks:
+                task.cancel()
+            raise
+        questions = merge_items(response["questions"] for response in responses)
+        logger.info(f"合并 {len(responses)} 个片段的结果，共 {len(questions)} 条信息")
+        return {"questions": questions}
@@ -0,0 +1,180 @@
+"""
+/v1/generate_answer 的压力测试，使用本地模拟的 Azure OpenAI 服务
+
+    python -m service.tools.load_test --requests 200 --latency 1.0
+
+模拟服务在 --latency 秒后返回固定的结构化结果，因此耗时只取决于
+服务能同时等待多少个LLM请求。--mode sync 在事件循环中直接调用同步的
+extract_informations（即异步改造前路由的做法），用于对比。
+--mode cold 为每个请求新建 ExtractQuery 及其客户端（即使用共享连接池前的
+做法）；配合 --latency 0 --concurrency 1 可以测出共享连接池为每个请求节省的时间：
+
+    python -m service.tools.load_test --requests 200 --latency 0 --concurrency 1
+    python -m service.tools.load_test --requests 200 --latency 0 --concurrency 1 --mode cold
+
+默认所有请求发送同一段转译内容，并发的相同请求会合并为一次LLM调用
+（LLM_SINGLE_FLIGHT），之后的请求命中结果缓存（LLM_CACHE_ENABLED）：
+
+    python -m service.tools.load_test --requests 100 --latency 1.0
+
+--unique 为每个请求生成不同的转译内容，用于测试服务本身的并发能力。
+
+--utterances 生成包含指定条数发言的长对话，--latency-per-kchar 使模拟服务的
+耗时随提示词长度增加，用于测试长对话的分片并发提取（LLM_CHUNK_CHARS=0 关闭分片）：
+
+    python -m service.tools.load_test --requests 1 --utterances 2000 --latency 1 --latency-per-kchar 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+
+MOCK_ANSWER = {"questions": ["新製品の発表は来週火曜日に決定", "プロジェクト予算は3万円以内に抑制"]}
+
+
+def create_mock_llm(latency, latency_per_kchar=0.0):
+    """返回模拟 Azure OpenAI chat completions 接口的应用
+
+    每个请求耗时 latency 秒，再加上每千字提示词 latency_per_kchar 秒。
+    """
+    mock = FastAPI()
+    mock.state.calls = 0
+
+    @mock.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        mock.state.calls += 1
+        delay = latency
+        if latency_per_kchar:
+            body = await request.json()
+            prompt_chars = sum(len(str(message["content"])) for message in body["messages"])
+            delay += latency_per_kchar * prompt_chars / 1000
+        await asyncio.sleep(delay)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": json.dumps(MOCK_ANSWER, ensure_ascii=False)},
+                }
+            ],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+
+    return mock
+
+
+def start_mock_llm(latency, latency_per_kchar=0.0):
+    """在后台线程中启动模拟服务，返回 (endpoint, app)"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    mock = create_mock_llm(latency, latency_per_kchar)
+    server = uvicorn.Server(uvicorn.Config(mock, log_level="warning"))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", mock
+
+
+async def run_load(app, concurrency, transcripts):
+    """并发调用 /v1/generate_answer，返回每个请求的耗时"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    # ASGITransport 不会触发 lifespan，这里手动进入
+    async with app.router.lifespan_context(app), httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://service", timeout=600
+    ) as client:
+        async def one(transcript):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/v1/generate_answer", json={"query": transcript})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(one(transcript) for transcript in transcripts))
+    return latencies
+
+
+async def run_sync_load(concurrency, transcripts):
+    """改造前的做法：在事件循环中直接调用同步客户端"""
+    from service.tools.extract_query import ExtractQuery
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(transcript):
+        async with semaphore:
+            started = time.perf_counter()
+            ExtractQuery().extract_informations(transcript, "openai")
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(transcript) for transcript in transcripts))
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test /v1/generate_answer against a mock LLM.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=1.0, help="Mock LLM response time in seconds")
+    parser.add_argument("--mode", choices=["async", "cold", "sync"], default="async")
+    parser.add_argument("--unique", action="store_true", help="Send a different transcript with every request")
+    parser.add_argument("--utterances", type=int, default=1, help="Number of utterances in each transcript")
+    parser.add_argument(
+        "--latency-per-kchar", type=float, default=0.0, help="Extra mock latency per 1000 prompt characters"
+    )
+    args = parser.parse_args()
+
+    endpoint, mock = start_mock_llm(args.latency, args.latency_per_kchar)
+    os.environ.update(
+        OPENAI_API_KEY="mock",
+        AZURE_OPENAI_ENDPOINT=endpoint,
+        OPENAI_API_VERSION="2024-08-01-preview",
+        DEPLOYMENT_4O="gpt-4o",
+        DEPLOYMENT_o1="o1",
+    )
+    speakers = ["佐藤", "鈴木", "田中"]
+    transcript = "\n".join(
+        f"{speakers[i % 3]}：議題{i}について、来週の火曜日までに担当者を決めて報告することにしました。"
+        for i in range(args.utterances)
+    )
+    if args.unique:
+        transcripts = [f"{transcript}（{i}）" for i in range(args.requests)]
+    else:
+        transcripts = [transcript] * args.requests
+
+    started = time.perf_counter()
+    if args.mode in ("async", "cold"):
+        from service.main import app
+        from service.api.dependencies import get_extract_query
+        from service.tools.extract_query import ExtractQuery
+
+        if args.mode == "cold":
+            app.dependency_overrides[get_extract_query] = ExtractQuery
+        latencies = asyncio.run(run_load(app, args.concurrency, transcripts))
+    else:
+        latencies = asyncio.run(run_sync_load(args.concurrency, transcripts))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(
+        f"{args.mode}: {args.requests} requests, {len(transcript)} chars each, concurrency {args.concurrency}, "
+        f"mock latency {args.latency:g}s, upstream calls {mock.state.calls}\n"
+        f"  total {elapsed:.2f}s; {args.requests / elapsed:.1f} req/s; "
+        f"p50 {statistics.median(latencies):.2f}s; "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f}s; "
+        f"mean {statistics.mean(latencies) * 1000:.1f}ms"
+    )
@@ -0,0 +1,251 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+
+# 配置日志
+logger = logging.getLogger("result_cache")
+
+# 缓存格式版本，结果的存储格式变化时修改，使旧条目全部失效
+CACHE_VERSION = 1
+
+
+def make_cache_key(system_prompt, user_prompt, model, temperature, response_format=None):
+    """根据提示词、部署名称、温度和响应格式计算缓存键
+
+    系统提示词按内容参与哈希，修改提示词后旧结果自动失效。
+    """
+    schema = None
+    if response_format is not None:
+        schema = response_format.model_json_schema()
+    payload = json.dumps(
+        [CACHE_VERSION, system_prompt, user_prompt, model, temperature, schema],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """LLM结果缓存：内存LRU + 可选的SQLite持久层
+
+    内存层按LRU淘汰，条目数不超过 max_entries，按JSON长度估算的大小不超过
+    max_bytes；条目超过 ttl 秒后过期。设置 path 时，结果同时写入SQLite文件，
+    同一台机器上的多个 worker 共享；内存未命中时从文件中读取。文件中最多保留
+    max_disk_entries 条，写入时删除过期和最早过期的条目。
+
+    多个 worker 各有自己的内存层。失效操作会增加文件中的失效代数，其他 worker
+    读取时发现代数变化就清空自己的内存层，不会继续返回已失效的结果。
+
+    异步代码使用 aget/aset，SQLite读写在线程中执行，等待其他 worker 的写锁时
+    不会阻塞事件循环。
+    """
+
+    def __init__(
+        self, max_entries=1024, ttl=86400, path=None, max_disk_entries=10000, max_bytes=64 * 2**20
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with self._connect() as db:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS results "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at)")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+                )
+                db.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('generation', 0)")
+                self._generation = self._read_generation(db)
+        logger.info(
+            f"结果缓存初始化完成, 最大条目数: {max_entries}, 最大内存: {max_bytes}字节, "
+            f"TTL: {ttl}秒, 持久化文件: {path or '无'}"
+        )
+
+    @contextmanager
+    def _connect(self):
+        with closing(sqlite3.connect(self.path, timeout=5)) as db:
+            with db:
+                yield db
+
+    @staticmethod
+    def _read_generation(db):
+        return db.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()[0]
+
+    def _sync_generation(self, db):
+        """其他 worker 执行过失效操作时清空内存层"""
+        generation = self._read_generation(db)
+        with self._lock:
+            if generation != self._generation:
+                logger.info(f"其他 worker 已使缓存失效, 清空内存层 {len(self._entries)} 条")
+                self._entries.clear()
+                self._bytes = 0
+                self._generation = generation
+
+    def get(self, key):
+        """返回缓存的结果，未命中或已过期时返回 None"""
+        now = time.time()
+        if not self.path:
+            value = self._get_memory(key, now)
+        else:
+            with self._connect() as db:
+                self._sync_generation(db)
+                value = self._get_memory(key, now)
+                if value is None:
+                    value = self._get_disk(db, key, now)
+        if value is None:
+            with self._lock:
+                self._misses += 1
+        return value
+
+    def _get_memory(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, size = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                # 返回副本，调用方修改结果不影响缓存
+                return copy.deepcopy(value)
+            del self._entries[key]
+            self._bytes -= size
+        return None
+
+    def _get_disk(self, db, key, now):
+        row = db.execute(
+            "SELECT value, expires_at FROM results WHERE key = ? AND expires_at > ?",
+            (key, now),
+        ).fetchone()
+        if row is None:
+            return None
+        value = json.loads(row[0])
+        with self._lock:
+            self._disk_hits += 1
+            self._store(key, value, row[1], len(row[0].encode("utf-8")))
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        """保存结果，value 需要可以序列化为JSON"""
+        now = time.time()
+        expires_at = now + self.ttl
+        text = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            # 保存副本，调用方之后修改结果不影响缓存
+            self._store(key, copy.deepcopy(value), expires_at, len(text.encode("utf-8")))
+        if self.path:
+            with self._connect() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, text, expires_at),
+                )
+                db.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+                # 超过上限时删除最早过期的条目
+                db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results "
+                    "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                )
+
+    async def aget(self, key):
+        """get 的异步版本"""
+        if self.path:
+            return await asyncio.to_thread(self.get, key)
+        return self.get(key)
+
+    async def aset(self, key, value):
+        """set 的异步版本"""
+        if self.path:
+            await asyncio.to_thread(self.set, key, value)
+        else:
+            self.set(key, value)
+
+    def _store(self, key, value, expires_at, size):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[2]
+        self._entries[key] = (expires_at, value, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or (
+            self._bytes > self.max_bytes and len(self._entries) > 1
+        ):
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+            self._evictions += 1
+
+    def invalidate(self, key=None):
+        """删除指定条目，key 为 None 时清空缓存；返回删除的条目数"""
+        with self._lock:
+            if key is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                entry = self._entries.pop(key, None)
+                removed = int(entry is not None)
+                if entry is not None:
+                    self._bytes -= entry[2]
+        if self.path:
+            with self._connect() as db:
+                if key is None:
+                    cursor = db.execute("DELETE FROM results")
+                else:
+                    cursor = db.execute("DELETE FROM results WHERE key = ?", (key,))
+                removed = max(removed, cursor.rowcount)
+                # 其他 worker 的内存层中可能还有这些条目，增加代数通知它们清空
+                db.execute("UPDATE meta SET value = value + 1 WHERE name = 'generation'")
+                generation = self._read_generation(db)
+            with self._lock:
+                self._generation = generation
+        logger.info(f"缓存已失效: {key or '全部'}, 删除 {removed} 条")
+        return removed
+
+    async def ainvalidate(self, key=None):
+        """invalidate 的异步版本"""
+        if self.path:
+            return await asyncio.to_thread(self.invalidate, key)
+        return self.invalidate(key)
+
+    def stats(self):
+        """返回命中率等统计信息"""
+        with self._lock:
+            hits = self._hits + self._disk_hits
+            lookups = hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "generation": self._generation,
+                "max_disk_entries": self.max_disk_entries,
+                "ttl": self.ttl,
+                "persistent": bool(self.path),
+                "hits": hits,
+                "memory_hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
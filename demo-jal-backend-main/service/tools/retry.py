@@ -1,5 +1,7 @@
 import time
 import random
+import asyncio
+import inspect
 import logging
 from functools import wraps
 from service.core.exceptions import ServiceException
@@ -9,15 +11,53 @@ logger = logging.getLogger("retry")
 def retry_with_backoff(max_retries=3, base_delay=1, max_delay=10, backoff_factor=2, jitter=0.1):
     """
     重试装饰器，带指数退避策略
-    
+
     参数:
         max_retries (int): 最大重试次数
         base_delay (float): 初始延迟时间（秒）
         max_delay (float): 最大延迟时间（秒）
         backoff_factor (float): 退避因子
         jitter (float): 抖动因子，增加随机性以避免同时重试
+
+    同时支持普通函数和协程函数：协程函数使用 asyncio.sleep 等待，
+    不会阻塞事件循环。
     """
+    def next_delay(retries, e):
+        """返回下一次重试前的延迟；超过最大重试次数时抛出异常"""
+        if retries > max_retries:
+            logger.error(f"重试失败，已达到最大重试次数 {max_retries}: {str(e)}")
+            if isinstance(e, ServiceException):
+                raise e
+            else:
+                # 将普通异常转换为服务异常
+                raise ServiceException(
+                    message=f"操作失败，已重试 {max_retries} 次",
+                    details={"original_error": str(e)}
+                ) from e
+
+        # 计算延迟时间
+        delay = min(base_delay * (backoff_factor ** (retries - 1)), max_delay)
+        # 添加随机抖动
+        delay = delay * (1 + random.uniform(-jitter, jitter))
+
+        logger.warning(
+            f"操作失败，将在 {delay:.2f} 秒后重试 (尝试 {retries}/{max_retries}): {str(e)}"
+        )
+        return delay
+
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                retries = 0
+                while True:
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        retries += 1
+                        await asyncio.sleep(next_delay(retries, e))
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             retries = 0
@@ -26,25 +66,6 @@ def retry_with_backoff(max_retries=3, base_delay=1, max_delay=10, backoff_factor
                     return func(*args, **kwargs)
                 except Exception as e:
                     retries += 1
-                    if retries > max_retries:
-                        logger.error(f"重试失败，已达到最大重试次数 {max_retries}: {str(e)}")
-                        if isinstance(e, ServiceException):
-                            raise
-                        else:
-                            # 将普通异常转换为服务异常
-                            raise ServiceException(
-                                message=f"操作失败，已重试 {max_retries} 次",
-                                details={"original_error": str(e)}
-                            )
-                    
-                    # 计算延迟时间
-                    delay = min(base_delay * (backoff_factor ** (retries - 1)), max_delay)
-                    # 添加随机抖动
-                    delay = delay * (1 + random.uniform(-jitter, jitter))
-                    
-                    logger.warning(
-                        f"操作失败，将在 {delay:.2f} 秒后重试 (尝试 {retries}/{max_retries}): {str(e)}"
-                    )
-                    time.sleep(delay)
+                    time.sleep(next_delay(retries, e))
         return wrapper
     return decorator
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+
+# 配置日志
+logger = logging.getLogger("single_flight")
+
+
+class _Call:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """合并并发的相同请求
+
+    同一个 key 的请求在执行期间只调用一次 func，其余调用方等待同一个结果；
+    func 抛出的异常会传给所有调用方。单个调用方被取消不影响其他调用方，
+    所有调用方都取消后才取消 func。结果对象在调用方之间共享，不要修改。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._leaders = 0
+        self._shared = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        """执行 func(*args, **kwargs)，相同 key 正在执行时等待其结果"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(func(*args, **kwargs)))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self._leaders += 1
+        else:
+            self._shared += 1
+            logger.info(f"合并相同请求: {key}")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                logger.info(f"所有调用方已取消，取消请求: {key}")
+                # 立即移除，之后相同 key 的请求重新调用 func
+                self._forget(key, call)
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # 所有调用方都已取消时，没有人读取异常，这里读取以免产生警告
+        if call.task.done() and not call.task.cancelled():
+            call.task.exception()
+
+    def stats(self):
+        """返回执行中的请求数和合并次数"""
+        return {
+            "in_flight": len(self._calls),
+            "upstream_calls": self._leaders,
+            "coalesced": self._shared,
+        }
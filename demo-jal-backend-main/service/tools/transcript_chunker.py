@@ -0,0 +1,102 @@
+import difflib
+import re
+import unicodedata
+
+# 句末标点，单条发言过长时在这些位置切分
+SENTENCE_END = re.compile(r"(?<=[。！？!?．.])")
+NUMBER = re.compile(r"\d+")
+
+
+def split_utterances(transcript):
+    """按行切分发言，去掉空行"""
+    return [line.strip() for line in transcript.splitlines() if line.strip()]
+
+
+def _split_long(utterance, max_chars):
+    """将超过 max_chars 的发言按句子切分，单句仍过长时按长度硬切"""
+    pieces = []
+    current = ""
+    for sentence in SENTENCE_END.split(utterance):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) > max_chars:
+            pieces.append(current)
+            current = ""
+        current += sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_transcript(transcript, max_chars=6000, overlap_chars=500):
+    """在发言边界处将转译内容切分为不超过 max_chars 的片段
+
+    每个片段开头重复上一片段末尾不超过 overlap_chars 的完整发言，
+    使跨片段的上下文不会丢失。内容不超过 max_chars 时返回单个片段。
+    """
+    utterances = []
+    for utterance in split_utterances(transcript):
+        utterances.extend(_split_long(utterance, max_chars) if len(utterance) > max_chars else [utterance])
+
+    chunks = []
+    current = []
+    size = 0
+    for utterance in utterances:
+        if current and size + len(utterance) + 1 > max_chars:
+            chunks.append(current)
+            # 从上一片段末尾取重叠的发言，并保证加上新发言后不超过 max_chars
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                if overlap_size + len(previous) + 1 > min(overlap_chars, max_chars - len(utterance) - 1):
+                    break
+                overlap.insert(0, previous)
+                overlap_size += len(previous) + 1
+            current = overlap
+            size = overlap_size
+        current.append(utterance)
+        size += len(utterance) + 1
+    if current:
+        chunks.append(current)
+    return ["\n".join(chunk) for chunk in chunks]
+
+
+def _normalize(item):
+    item = unicodedata.normalize("NFKC", item).strip().lstrip("-・*").strip()
+    return re.sub(r"[\s。、，,.．]+", "", item).lower()
+
+
+def merge_items(item_lists, similarity=0.9):
+    """按片段顺序合并提取结果，去除完全相同或高度相似的项目
+
+    片段之间有重叠，同一条信息可能被相邻片段各提取一次，措辞略有不同。
+    包含的数字不同的项目不视为重复。
+    """
+    merged = []
+    seen = []
+    for items in item_lists:
+        for item in items:
+            key = _normalize(item)
+            if not key:
+                continue
+            numbers = NUMBER.findall(key)
+            duplicate = False
+            for other, other_numbers in seen:
+                if key == other:
+                    duplicate = True
+                    break
+                # 数字不同（日期、金额等）的项目即使措辞相似也保留
+                if numbers != other_numbers:
+                    continue
+                matcher = difflib.SequenceMatcher(None, key, other)
+                if matcher.quick_ratio() >= similarity and matcher.ratio() >= similarity:
+                    duplicate = True
+                    break
+            if not duplicate:
+                seen.append((key, numbers))
+                merged.append(item)
+    return merged